@@ -18,12 +18,13 @@ from typing import Literal
 
 # local import 
 from utils import Domain, CNameLoopsTooLong
-from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR
+from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TLS_MAXCONCURRENCY, TLS_TIMEOUT, TLS_ALPN
+from limiter import report_outcome
 
 
-#         
-from multi_parsing import unpack_domain_obj
-import subprocess
+import ssl
+import json
+import glob
 
 
 
@@ -204,25 +205,65 @@ def getips(msg):
     return ipv4, ipv6
 
 
-def send_and_save_request(ipaddr, port, sni, outputfpath, iptype):
+def get_tls_semaphore() -> asyncio.Semaphore:
+    """TLS probes have their own concurrency limit, separate from the DNS queries"""
+    global _TLS_SEM
+    if _TLS_SEM is None:
+        _TLS_SEM = asyncio.Semaphore(TLS_MAXCONCURRENCY)
+    return _TLS_SEM
+
+_TLS_SEM = None
+
+
+async def probe_tls(ipaddr, port, sni, timeout=TLS_TIMEOUT) -> dict:
     """
-    send tls hand shake to ip:port sni and saved the response to outputfpath
+    open a TLS connection to ip:port with SNI and record the negotiated
+    version, cipher, ALPN and the certificate chain presented by the server.
+    like `openssl s_client`, the certificate is recorded but not verified.
     """
-    
-    if iptype == "ipv4":
-        commands = f'''
-        openssl s_client -connect {ipaddr}:{port} -servername {sni} <<< Q >> {outputfpath} 2>&1
-        '''
-    elif iptype == "ipv6":
-        commands = f'''
-        openssl s_client -connect [{ipaddr}]:{port} -servername {sni} <<< Q >> {outputfpath} 2>&1
-        '''
-    else:
-        return 0
-    process = subprocess.Popen('/bin/bash', stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
-    out, err = process.communicate(commands)
-    print(out)
-    return 0
+    res = {"ip": ipaddr, "port": int(port), "sni": sni, 
+           "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+           "version": None, "cipher": None, "alpn": None, "certs": [], "error": None}
+
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(TLS_ALPN)
+
+    async with get_tls_semaphore():
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ipaddr, int(port), ssl=context, server_hostname=sni), timeout)
+        except Exception as err:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            res["error"] = "{}: {}".format(exc_type.__name__, exc_value)
+            return res
+
+        try:
+            sslobj = writer.get_extra_info("ssl_object")
+            res["version"] = sslobj.version()
+            res["cipher"] = sslobj.cipher()
+            res["alpn"] = sslobj.selected_alpn_protocol()
+            if hasattr(sslobj, "get_unverified_chain"): # python >= 3.13, DER bytes of the whole chain
+                chain = list(sslobj.get_unverified_chain())
+            else:
+                chain = [sslobj.getpeercert(binary_form=True)]
+            res["certs"] = [ssl.DER_cert_to_PEM_cert(cert) for cert in chain if cert is not None]
+        finally:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), timeout)
+            except Exception:
+                pass
+    return res
+
+
+async def probe_and_save(ipaddr, port, sni, outputfpath) -> dict:
+    """probe ip:port with sni and save the result as json to outputfpath"""
+    res = await probe_tls(ipaddr, port, sni)
+    with open(outputfpath, "w") as outfile:
+        json.dump(res, outfile)
+    return res
 
 
 def ip_match(httpsipl, ipbasel):
@@ -238,6 +279,101 @@ def ip_match(httpsipl, ipbasel):
     return False
 
 
+def get_probe_jobs(domain: Domain) -> list:
+    """
+    compare the ipv4hint/ipv6hint of the HTTPS records with the A/AAAA records of the domain,
+    and return one probe job per address source when they do not match.
+    """
+    if "HTTPS" not in domain.message or "A" not in domain.message or "AAAA" not in domain.message:
+        return []
+    aaaa = get_dns_ip(domain.message['AAAA'])
+    a = get_dns_ip(domain.message['A'])
+    ipv4, ipv6 = getips(domain.message['HTTPS'])
+
+    jobs = []
+    if not ip_match(ipv4, a):
+        print("[LOG]:", domain.name, ",A:", a, ",ipv4hint:", ipv4)
+        ## if ipv4s do not match, we send tls connections to ipv4hints and A addresses.
+        jobs.append({"domain": domain.name, "sni": domain.name, "ips": ipv4, "source": "ipv4"})
+        jobs.append({"domain": domain.name, "sni": domain.name, "ips": a, "source": "a"})
+
+    if not ip_match(ipv6, aaaa):
+        print("[LOG]:", domain.name, ",AAAA:", aaaa, ",ipv6hint:", ipv6)
+        ## if ipv6 do not match, we send tls connections to ipv6hints and AAAA addresses.
+        jobs.append({"domain": domain.name, "sni": domain.name, "ips": ipv6, "source": "ipv6"})
+        jobs.append({"domain": domain.name, "sni": domain.name, "ips": aaaa, "source": "aaaa"})
+    return jobs
+
+
+async def run_probe_job(job: dict, tlsdir: str, logday: str):
+    """probe every address of the job, results are saved under tlsdir/logday/domain"""
+    dirpath = os.path.join(tlsdir, logday, job["domain"])
+    os.makedirs(dirpath, exist_ok=True)
+    await asyncio.gather(*[probe_and_save(ipadd, '443', job["sni"], os.path.join(dirpath, f"{job['source']}_{ipadd}.json")) 
+                           for ipadd in job["ips"]])
+
+
+def probe_job_done(job: dict, tlsdir: str, logday: str) -> bool:
+    dirpath = os.path.join(tlsdir, logday, job["domain"])
+    return all([os.path.exists(os.path.join(dirpath, f"{job['source']}_{ipadd}.json")) for ipadd in job["ips"]])
+
+
+async def query_tlsconnect(domain: Domain, tlsdir: str, logday: str):
+    """check the ip addresses of the domain and probe TLS inline when they do not match"""
+    await asyncio.gather(*[run_probe_job(job, tlsdir, logday) for job in get_probe_jobs(domain)])
+
+
+class ProbeJobQueue:
+    """
+    persisted queue of TLS probe jobs, one json line per job.
+    every process appends to its own file under tlsdir/logday/jobs, so the DNS
+    workers never wait on each other or on a TLS handshake; scpt_tlsconnect.py consumes the files.
+    """
+    def __init__(self, tlsdir: str, logday: str):
+        self.dirpath = os.path.join(tlsdir, logday, "jobs")
+        self.outfile = None
+        self.pid = None
+
+    def put(self, job: dict):
+        if self.outfile is None or self.pid != os.getpid():
+            os.makedirs(self.dirpath, exist_ok=True)
+            self.pid = os.getpid()
+            self.outfile = open(os.path.join(self.dirpath, f"probejobs_{self.pid}.jsonl"), "a")
+        self.outfile.write(json.dumps(job) + "\n")
+        self.outfile.flush()
+
+
+def read_probe_jobs(tlsdir: str, logday: str) -> list:
+    """load every queued probe job of the day, skipping duplicates"""
+    jobs = {}
+    for fpath in sorted(glob.glob(os.path.join(tlsdir, logday, "jobs", "*.jsonl"))):
+        with open(fpath) as infile:
+            for line in infile:
+                try:
+                    job = json.loads(line)
+                except ValueError: # partially written last line
+                    continue
+                jobs[(job["domain"], job["source"])] = job
+    return list(jobs.values())
+
+
+_PROBE_QUEUES = {}
+
+
+def emit_probe_jobs(domain: Domain, tlsdir: str, logday: str) -> int:
+    """queue the probe jobs of the domain for the TLS stage instead of probing inline"""
+    jobs = get_probe_jobs(domain)
+    if len(jobs) == 0:
+        return 0
+    queue = _PROBE_QUEUES.get((tlsdir, logday))
+    if queue is None:
+        queue = ProbeJobQueue(tlsdir, logday)
+        _PROBE_QUEUES[(tlsdir, logday)] = queue
+    for job in jobs:
+        queue.put(job)
+    return len(jobs)
+
+
 async def query_domain(domain: Domain, resolver: dns.asyncresolver) -> Domain:
     try:
         domain = await set_dns_records(domain, resolver, "HTTPS")
@@ -265,50 +401,7 @@ async def query_domain(domain: Domain, resolver: dns.asyncresolver) -> Domain:
         domain = await set_dns_records(domain, resolver, "A")
         domain = await set_dns_records(domain, resolver, "AAAA")
         
-        """
-        send queries
-        """
-        aaaa = get_dns_ip(domain.message['AAAA'])
-        a = get_dns_ip(domain.message['A'])
-        ipv4, ipv6 = getips(domain.message['HTTPS'])
-        #print(a, ipv4, aaaa, ipv6)
-        
-        today = datetime.datetime.now()
-        daystr = today.strftime("%Y-%m-%d")
-        #daystr = "2024-01-29"
-        #daystr = "2024-02-03"
-
-        if not ip_match(ipv4, a): 
-            print("[LOG]:", domain.name, ",A:", a, ",ipv4hint:", ipv4)
-            ## if ipv4s do not match, we send tls connections to ipv4hints.
-            dirpath = "/data2/tlsconnect/{}/{}".format(daystr, domain.name)
-            if not os.path.exists(dirpath):
-                os.mkdir(dirpath)
-
-            for ipadd in ipv4:
-                print(ipadd, domain.name, os.path.join(dirpath, f"ipv4_{ipadd}.log"))
-                send_and_save_request(ipadd, '443', domain.name, outputfpath=os.path.join(dirpath, f"ipv4_{ipadd}.log"), iptype="ipv4")
-            
-            for ipadd in a:
-                print(ipadd, domain.name, os.path.join(dirpath, f"a_{ipadd}.log"))
-                send_and_save_request(ipadd, '443', domain.name, outputfpath=os.path.join(dirpath, f"a_{ipadd}.log"), iptype="ipv4")
-
-
-        if not ip_match(ipv6, aaaa):
-            print("[LOG]:", domain.name, ",AAAA:", aaaa, ",ipv4hint:", ipv6)
-            ## if ipv6 do not match, we send tls connections to ipv6hints.
-            dirpath = "/data2/tlsconnect/{}/{}".format(daystr, domain.name)
-            if not os.path.exists(dirpath):
-                os.mkdir(dirpath)
-            
-            for ipadd in ipv6:
-                print(ipadd, domain.name, os.path.join(dirpath, f"ipv6_{ipadd}.log"))
-                send_and_save_request(ipadd, '443', domain.name, outputfpath=os.path.join(dirpath, f"ipv6_{ipadd}.log"), iptype="ipv6")
-            
-            for ipadd in aaaa:
-                print(ipadd, domain.name, os.path.join(dirpath, f"aaaa_{ipadd}.log"))
-                send_and_save_request(ipadd, '443', domain.name, outputfpath=os.path.join(dirpath, f"aaaa_{ipadd}.log"), iptype="ipv6")
-
+        await query_tlsconnect(domain, "/data2/tlsconnect", datetime.datetime.now().strftime("%Y-%m-%d"))
 
     except Exception as err:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -329,6 +422,7 @@ async def safe_async_query(domain: Domain, resolver: dns.asyncresolver, sem: asy
     Restrict the concurrency of query with asyncio.Semaphore.
     """
     async with sem:  # semaphore limits num of simultaneous queries
+        s = time.perf_counter()
         try:
             res = await query_domain(domain, resolver)
             data_dict[domain.name] = res #store data in dictionary
@@ -336,6 +430,8 @@ async def safe_async_query(domain: Domain, resolver: dns.asyncresolver, sem: asy
         except:
             # if the request domain does not have HTTPS answer, we do not store the data in data_dict.
             pass
+        finally:
+            report_outcome(sem, domain, time.perf_counter() - s)
 
 
 async def query_all_dns_https(domains: [Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, data_dict:dict):
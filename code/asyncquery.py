@@ -14,19 +14,45 @@ import asyncio
 import time
 import datetime
 import numpy as np
-from typing import Literal
+from typing import Literal, Iterable, Iterator, Callable, Awaitable
 import subprocess
 
 # local import 
 from utils import Domain, CNameLoopsTooLong
-from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TLS_DIR
-from TLSconnection import query_tlsconnect
-
-def get_resolver(addresses=None, lifetime=5, payload=1420, AuthenticData=False):
+from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TLS_DIR, QUERY_FANOUT, QUERY_BACKEND, RESOLVER_BALANCE, ANSWER_CACHE
+from dnsengine import get_raw_resolver, close_socket_pools
+from limiter import get_semaphore, worker_count, report_outcome
+from resolverpool import ResolverPool, TokenBucket
+from dnscache import CachingResolver, get_answer_cache, get_cname_cache, zone_for_name
+from asyncTLSconnection import emit_probe_jobs
+
+def get_resolver(addresses=None, lifetime=5, payload=1420, AuthenticData=False, backend=QUERY_BACKEND, 
+                 balance=RESOLVER_BALANCE, cache=ANSWER_CACHE):
     """
     Return asyncresolver object configured to use given list of addresses, and
     that sets DO=1, RD=1, AD=1, and EDNS payload for queries to the resolver.
+    with backend="raw", return a dnsengine.RawResolver that sends the queries over
+    a shared pool of long-lived UDP sockets instead.
+    with balance and several addresses, return a resolverpool.ResolverPool that spreads
+    the queries over one resolver per address, sharing the lifetime between them.
+    with cache, the resolver is wrapped in a dnscache.CachingResolver backed by the
+    answer cache of the process.
     """
+    if cache:
+        return CachingResolver(get_resolver(addresses, lifetime=lifetime, payload=payload, AuthenticData=AuthenticData, 
+                                            backend=backend, balance=balance, cache=False), get_answer_cache())
+
+    if balance and addresses is not None and len(addresses) > 1:
+        return ResolverPool({addr: get_resolver([addr], lifetime=lifetime / len(addresses), payload=payload, 
+                                                AuthenticData=AuthenticData, backend=backend, balance=False, 
+                                                cache=False) 
+                             for addr in addresses})
+
+    if backend == "raw":
+        if addresses is None:
+            addresses = dns.resolver.get_default_resolver().nameservers
+        return get_raw_resolver(addresses, lifetime=lifetime, payload=payload, AuthenticData=AuthenticData)
+
     resolver = dns.asyncresolver.Resolver()
 
     if AuthenticData == True:
@@ -69,7 +95,7 @@ async def query_dns_rec(domain: Domain, resolver: dns.asyncresolver, query_type:
                 qname = dns.name.from_text(domain.cname)
             else:
                 try:
-                    qname = dns.resolver.zone_for_name(domain.cname)
+                    qname = await zone_for_name(domain.cname, resolver)
                 except:
                     qname = dns.name.from_text(domain.cname)
     
@@ -80,45 +106,67 @@ async def query_dns_rec(domain: Domain, resolver: dns.asyncresolver, query_type:
         raise err
 
 
-async def query_https_rec(domain: Domain, resolver: dns.asyncresolver) -> Domain:
+def remember_cnames(msg: dns.message.QueryMessage):
+    """memoize every alias -> target hop in the answer section for the rest of the run"""
+    memo = get_cname_cache()
+    for rr in msg.answer:
+        if ifCNAME(rr):
+            memo.put((rr.name.to_text().lower(), "CNAME"), rr[0].target.to_text(), rr.ttl)
+
+
+def follow_cnames(cname: str) -> str:
+    """follow the memoized chain from cname to the last target seen in this run"""
+    memo = get_cname_cache()
+    for _ in range(20):
+        target = memo.get((cname.lower(), "CNAME"))
+        if target is None or target == cname:
+            break
+        cname = target
+    return cname
+
+
+async def query_https_rec(domain: Domain, resolver: dns.asyncresolver) -> dns.message.QueryMessage:
     """
     query dns https records given the domain object and the dns asynchronous resolver.
     if cname was returned, resolving the correct cname and query the corresponding https record.
     return the corresponding dns response or raise error
 
+    the cname chain is followed in a loop: when the resolver already chased the chain in the
+    answer section, that answer is returned as is; otherwise only the final target is re-queried,
+    starting from the furthest target memoized earlier in the run.
+
     Parameters
     ----------
     domain : Domain
     resolver : dns.asyncresolver    
     """
-    try:
-        msg = await query_dns_rec(domain, resolver, "HTTPS")
-        
-        # if no CNAME records, return domain https records
-        if not any([ifCNAME(rr) for rr in msg.answer]):
-            return msg
+    msg = await query_dns_rec(domain, resolver, "HTTPS")
     
-        # resolve cname and query the corresponding HTTPS records       
-        try:
-            cname = msg.resolve_chaining().canonical_name.to_text()
-
-            domain.set_cname(cname)
-            
-            # just to make sure there's no loop.
-            domain.__cnameloop__ += 1
-            if domain.__cnameloop__ > 20:
-                domain.set_error("CNAME", "CNameLoopsTooLong")
-                raise CNameLoopsTooLong
-                
-            print("REQUERYING CNAME:", domain.cname)
-            coro = query_https_rec(domain, resolver)
-            task = await asyncio.create_task(coro)
-            return task # requery till resolved
-        except Exception as err: # capture cname resolving error 
-            raise err
-            
-    except Exception as err: # capture dns https query error
-        raise err
+    # if no CNAME records, return domain https records
+    while any([ifCNAME(rr) for rr in msg.answer]):
+        remember_cnames(msg)
+        chain = msg.resolve_chaining()
+        if chain.answer is not None:
+            # the answer section already ends in the target's HTTPS records
+            domain.set_cname(chain.canonical_name.to_text())
+            return msg
+
+        domain.set_cname(follow_cnames(chain.canonical_name.to_text()))
+        
+        # just to make sure there's no loop.
+        domain.__cnameloop__ += 1
+        if domain.__cnameloop__ > 20:
+            domain.set_error("CNAME", "CNameLoopsTooLong")
+            raise CNameLoopsTooLong
+
+        targets = get_cname_cache()
+        key = (domain.cname.lower(), "HTTPS")
+        msg = targets.get(key)
+        if msg is None:
+            msg = await query_dns_rec(domain, resolver, "HTTPS") # requery the target
+            targets.put(key, msg, msg.resolve_chaining().minimum_ttl)
+
+    return msg
 
         
 async def set_dns_records(domain: Domain, resolver: dns.asyncresolver, 
@@ -151,8 +199,30 @@ async def set_dns_records(domain: Domain, resolver: dns.asyncresolver,
     return domain
 
 
+async def set_dns_records_fanout(domain: Domain, resolver: dns.asyncresolver,
+                                 query_types: [Literal["A", "AAAA", "NS", "SOA"]]) -> Domain:
+    """
+    query several record types of the same domain concurrently.
+    each lookup stores its message or error through set_dns_records, so the
+    Domain.message / Domain.error maps end up the same as with sequential queries.
+
+    Parameters
+    ----------
+    domain : Domain
+    resolver : dns.asyncresolver,
+    query_types : list of Literal["A", "AAAA", "NS", "SOA"]
+    """
+    # set_dns_records only re-raises for HTTPS, so one failed lookup never cancels the others
+    await asyncio.gather(*[set_dns_records(domain, resolver, qtype) for qtype in query_types])
+    return domain
+
 
-async def query_domain(domain: Domain, resolver: dns.asyncresolver, dtype:Literal["apex", "www"], logday:str) -> Domain:
+async def query_domain(domain: Domain, resolver: dns.asyncresolver, dtype:Literal["apex", "www"], logday:str,
+                       fanout: bool = QUERY_FANOUT) -> Domain:
+    """
+    query HTTPS for the domain; if it has HTTPS records, query NS, SOA, A and AAAA as well.
+    with fanout, the follow-up lookups are sent concurrently instead of one after another.
+    """
     try:
         domain = await set_dns_records(domain, resolver, "HTTPS")
         
@@ -164,14 +234,18 @@ async def query_domain(domain: Domain, resolver: dns.asyncresolver, dtype:Litera
         
         
         """ starting from 2023-07-06, we query A, AAAA, NS for any domain that has HTTPS rr """
-        domain = await set_dns_records(domain, resolver, "NS")
-        domain = await set_dns_records(domain, resolver, "SOA")
-        domain = await set_dns_records(domain, resolver, "A")
-        domain = await set_dns_records(domain, resolver, "AAAA")
+        if fanout:
+            domain = await set_dns_records_fanout(domain, resolver, ["NS", "SOA", "A", "AAAA"])
+        else:
+            domain = await set_dns_records(domain, resolver, "NS")
+            domain = await set_dns_records(domain, resolver, "SOA")
+            domain = await set_dns_records(domain, resolver, "A")
+            domain = await set_dns_records(domain, resolver, "AAAA")
 
         if dtype == "apex":
-            # if it's apex domain, we check ip addresses and send tls connection when ip mismatch
-            query_tlsconnect(domain, TLS_DIR, logday)
+            # if it's apex domain, we check ip addresses and queue tls connections when ip mismatch,
+            # the probes run in a separate stage (scpt_tlsconnect.py)
+            emit_probe_jobs(domain, TLS_DIR, logday)
 
     except Exception as err:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -192,6 +266,7 @@ async def safe_async_query(domain: Domain, resolver: dns.asyncresolver, sem: asy
     Restrict the concurrency of query with asyncio.Semaphore.
     """
     async with sem:  # semaphore limits num of simultaneous queries
+        s = time.perf_counter()
         try:
             res = await query_domain(domain, resolver, dtype, logday)
             data_dict[domain.name] = res #store data in dictionary
@@ -201,33 +276,82 @@ async def safe_async_query(domain: Domain, resolver: dns.asyncresolver, sem: asy
             #print("ERROR TYPE:", exc_type.__name__, ",ERROR VALUE:", exc_value)
             # if the request domain does not have HTTPS answer, we do not store the data in data_dict.
             pass
+        finally:
+            report_outcome(sem, domain, time.perf_counter() - s)
 
 
-async def query_all_dns_https(domains: [Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, 
-                              data_dict:dict, dtype:Literal["apex", "www"], logday: str):
+async def run_worker_pool(domains: Iterable[Domain], worker: Callable[[Domain], Awaitable], 
+                          nworkers: int = MAXCONCURRENCY):
+    """
+    run `worker` on every domain with a fixed number of long-lived worker coroutines.
+    domains are pulled from a bounded queue, so at most about 2 * nworkers Domain
+    objects are pending at any time and `domains` can be a lazy iterator of any size.
+
+    Parameters
+    ----------
+    domains : iterable of Domain
+    worker : coroutine function taking one Domain
+    nworkers : int
+    """
+    queue = asyncio.Queue(maxsize=2 * nworkers)
+
+    async def consume():
+        while True:
+            domain = await queue.get()
+            if domain is None: # sentinel, no more domains
+                return
+            try:
+                await worker(domain)
+            except Exception as err:
+                exc_type, exc_value, exc_traceback = sys.exc_info()
+                print("WORKER ERROR LOG:", getattr(domain, "name", domain), ",ERROR TYPE:", exc_type.__name__, ",ERROR VALUE:", exc_value)
+
+    workers = [asyncio.ensure_future(consume()) for _ in range(nworkers)]
+    try:
+        for domain in domains:
+            await queue.put(domain)
+        for _ in range(nworkers):
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+async def query_all_dns_https(domains: Iterable[Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, 
+                              data_dict:dict, dtype:Literal["apex", "www"], logday: str, nworkers: int = None):
     """
     Wrap function to query all domains
     """
-    tasks = [asyncio.ensure_future(safe_async_query(domain, resolver, sem, data_dict, dtype, logday)) for domain in domains]
-    await asyncio.gather(*tasks)
-    
+    if nworkers is None:
+        nworkers = worker_count(sem)
+    await run_worker_pool(domains, lambda domain: safe_async_query(domain, resolver, sem, data_dict, dtype, logday), 
+                          nworkers)
     
+
+def iter_domain_list(df: pd.DataFrame, columnname: str) -> Iterator[Domain]:
+    """
+    lazily initiate domains from the dataframe, one at a time
+    """
+    for name, rank in zip(df[columnname], df["rank"]):
+        yield Domain(name, rank)
+
+
 def init_domain_list(df: pd.DataFrame, columnname: str) -> [Domain]:
     """
     initiate all domain into a list
     """
-    dom_l = []
-    for idx, item in df.iterrows():
-        dom = Domain(item[columnname], item["rank"])
-        dom_l.append(dom)
-    return dom_l
+    return list(iter_domain_list(df, columnname))
 
 
 async def query_domain_ns_soa(domain: Domain, resolver: dns.asyncresolver) -> Domain:
     try:
         """query NS and SOA for any given domain"""
-        domain = await set_dns_records(domain, resolver, "NS")
-        domain = await set_dns_records(domain, resolver, "SOA")
+        if QUERY_FANOUT:
+            domain = await set_dns_records_fanout(domain, resolver, ["NS", "SOA"])
+        else:
+            domain = await set_dns_records(domain, resolver, "NS")
+            domain = await set_dns_records(domain, resolver, "SOA")
     except Exception as err:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         # raise noanswer error so we can capture this error and skip the request during safe_async_query()
@@ -246,6 +370,7 @@ async def safe_async_query_ns_soa(domain: Domain, resolver: dns.asyncresolver, s
     Restrict the concurrency of query with asyncio.Semaphore.
     """
     async with sem:  # semaphore limits num of simultaneous queries
+        s = time.perf_counter()
         try:
             res = await query_domain_ns_soa(domain, resolver)
             data_dict[domain.name] = res #store data in dictionary
@@ -253,14 +378,18 @@ async def safe_async_query_ns_soa(domain: Domain, resolver: dns.asyncresolver, s
         except:
             # if the request domain does not have HTTPS answer, we do not store the data in data_dict.
             pass
+        finally:
+            report_outcome(sem, domain, time.perf_counter() - s)
 
 
-async def query_all_dns_ns_soa(domains: [Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, data_dict:dict):
+async def query_all_dns_ns_soa(domains: Iterable[Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, 
+                               data_dict:dict, nworkers: int = None):
     """
     Wrap function to query NS and SOA records for all given domains
     """
-    tasks = [asyncio.ensure_future(safe_async_query_ns_soa(domain, resolver, sem, data_dict)) for domain in domains]
-    await asyncio.gather(*tasks)
+    if nworkers is None:
+        nworkers = worker_count(sem)
+    await run_worker_pool(domains, lambda domain: safe_async_query_ns_soa(domain, resolver, sem, data_dict), nworkers)
 
 
     
@@ -288,9 +417,12 @@ def get_wwwName(name):
 
 async def query_nameserver_ip(domain: Domain, resolver: dns.asyncresolver) -> Domain:
     try:
-        """query NS and SOA for any given domain"""
-        domain = await set_dns_records(domain, resolver, "A")
-        domain = await set_dns_records(domain, resolver, "AAAA")
+        """query A and AAAA for any given nameserver"""
+        if QUERY_FANOUT:
+            domain = await set_dns_records_fanout(domain, resolver, ["A", "AAAA"])
+        else:
+            domain = await set_dns_records(domain, resolver, "A")
+            domain = await set_dns_records(domain, resolver, "AAAA")
     except Exception as err:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         # raise noanswer error so we can capture this error and skip the request during safe_async_query()
@@ -311,16 +443,29 @@ async def safe_async_query_nameserver_ip(domain: Domain,
     Restrict the concurrency of query with asyncio.Semaphore.
     """
     async with sem:  # semaphore limits num of simultaneous queries
+        s = time.perf_counter()
         try:
             res = await query_nameserver_ip(domain, resolver)
             data_dict[domain.name] = res #store data in dictionary
             return res
         except:
             pass
+        finally:
+            report_outcome(sem, domain, time.perf_counter() - s)
 
-async def query_all_nameserver_ip(domains: [Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, data_dict:dict):
+async def query_all_nameserver_ip(domains: Iterable[Domain], resolver: dns.asyncresolver, sem: asyncio.Semaphore, 
+                                  data_dict:dict, nworkers: int = None, rate: float = None):
     """
-    Wrap function to query NS and SOA records for all given domains
+    Wrap function to query A and AAAA records for all given nameservers,
+    starting at most `rate` nameservers per second if given
     """
-    tasks = [asyncio.ensure_future(safe_async_query_nameserver_ip(domain, resolver, sem, data_dict)) for domain in domains]
-    await asyncio.gather(*tasks)
\ No newline at end of file
+    if nworkers is None:
+        nworkers = worker_count(sem)
+    bucket = TokenBucket(rate) if rate is not None else None
+
+    async def worker(domain):
+        if bucket is not None:
+            await bucket.acquire()
+        return await safe_async_query_nameserver_ip(domain, resolver, sem, data_dict)
+
+    await run_worker_pool(domains, worker, nworkers)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import json
+import datetime
+
+# local import
+from rawstore import RECORD_LEN, RAW_EXT, chunk_done, decode_record, list_raw_files
+
+"""
+checkpoints of a daily query run.
+
+the run manifest DATAROOT_DIR/<date>/manifest.json records how the Tranco list was split into chunks,
+so that a resumed run rebuilds the same chunks. a chunk is done when its completion marker exists
+(raw record files) or its pickle exists; a raw record file without marker holds the domains finished
+before the run stopped, and only the rest of the chunk is queried again.
+"""
+
+MANIFEST_NAME = "manifest.json"
+
+
+def manifest_path(outdir: str) -> str:
+    return os.path.join(outdir, MANIFEST_NAME)
+
+
+def write_manifest(outdir: str, maxsplit: int, chunk_sizes: list) -> dict:
+    """record the chunk layout of a run: number of chunks, total rows and row range of every chunk"""
+    chunks = []
+    start = 0
+    for size in chunk_sizes:
+        chunks.append([start, start + size])
+        start += size
+    manifest = {"created": datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+                "maxsplit": maxsplit,
+                "total": start,
+                "format": RAW_EXT,
+                "chunks": chunks}
+    with open(manifest_path(outdir), "w") as outfile:
+        json.dump(manifest, outfile)
+    return manifest
+
+
+def load_manifest(outdir: str) -> dict:
+    """the manifest of an earlier run, None if there is none"""
+    fpath = manifest_path(outdir)
+    if not os.path.exists(fpath):
+        return None
+    with open(fpath, "r") as infile:
+        return json.load(infile)
+
+
+def chunk_status(fpath: str) -> str:
+    """'done', 'partial' (file exists but the chunk did not finish) or 'todo'"""
+    if chunk_done(fpath):
+        return "done"
+    if os.path.exists(fpath):
+        return "partial"
+    return "todo"
+
+
+def recover_record_file(fpath: str) -> set:
+    """
+    make a partially written raw record file appendable again and return the names of
+    the domains it holds completely.
+    the records of the last domain in the file may have been cut by the crash, so they are
+    dropped together with any truncated record, and that domain is queried again.
+    """
+    last_start = 0      # offset of the first record of the last domain seen
+    last_name = None
+    names = set()
+    with open(fpath, "rb") as infile:
+        offset = 0
+        while True:
+            head = infile.read(RECORD_LEN.size)
+            if len(head) < RECORD_LEN.size:
+                break
+            (length,) = RECORD_LEN.unpack(head)
+            body = infile.read(length)
+            if len(body) < length:
+                break
+            name = decode_record(body).name
+            if name != last_name:
+                if last_name is not None:
+                    names.add(last_name)
+                last_name = name
+                last_start = offset
+            offset += RECORD_LEN.size + length
+
+    with open(fpath, "r+b") as outfile:
+        outfile.truncate(last_start)
+    return names
+
+
+def summarize_progress(file_fmts: list, keys: list) -> dict:
+    """count chunks by status over all output file formats"""
+    res = {"done": 0, "partial": 0, "todo": 0}
+    for fmt in file_fmts:
+        for key in keys:
+            res[chunk_status(fmt.format(key))] += 1
+    return res
+
+
+def unfinished_chunks(dirpath: str) -> list:
+    """
+    chunk files of a query folder that are missing or were not completely written.
+    with a manifest in the folder every non-empty chunk it lists is expected, without one
+    (older runs) only the files present are checked.
+    """
+    manifest = load_manifest(dirpath)
+    if manifest is None:
+        return [fpath for fpath in list_raw_files(dirpath) if not chunk_done(fpath)]
+    fmt = os.path.join(dirpath, "output_{:03d}" + manifest["format"])
+    return [fmt.format(idx) for idx, (start, end) in enumerate(manifest["chunks"])
+            if end > start and not chunk_done(fmt.format(idx))]
@@ -6,11 +6,23 @@ TRANCO_DIR = "/data/tranco"
 
 # path th store parsed daily query
 PARSE_DIR = "/data/parsed"
+# typed parquet copy of the parsed data, partitioned by date and dtype (parsedstore.py)
+PARQUET_DIR = "/data/parsed/parquet"
+# default output of multi_parsing.py: "csv", "parquet" or "both"
+PARSED_FORMAT = "csv"
+# per-domain byte offset index over the parsed daily csv files (parsedindex.py)
+PARSED_INDEX_DB = "/data/parsed/index.db"
 
 # path to store NS and SOA query for domain history measurement
 HIST_DIR = "/data/history/raw"
 HIST_PARSED = "/data/history/parsed"
 HIST_DB = "/data/history/history.db"
+# re-query only the domains seen with HTTPS records in the last N days, None for all (dbschema.py)
+HIST_ACTIVE_DAYS = None
+# change-only NS/SOA store (histdelta.py), and which outputs scpt_hist_parsing writes: csv, delta or both.
+# "delta" replaces the daily full csv snapshot, "csv"/"both" keep writing it (more disk than before with both)
+HIST_DELTA_DB = "/data/history/nssoa_delta.db"
+HIST_STORE = "delta"
 
 ERRDF_DIR = "/data/errordom/raw"
 ERRDF_PARSED = "/data/errordom/raw"
@@ -19,6 +31,19 @@ ERRDF_PARSED = "/data/errordom/raw"
 NSIP_DIR = "/data/nsIP/raw"
 NSIP_PARSED = "/data/nsIP/parsed"
 NSIP_DB = "/data/nsIP/NameServerIP.db"
+# query only the nameservers seen in the last N days, None for all
+NSIP_ACTIVE_DAYS = None
+# nameserver sweep: shards on a consistent hash ring (None for 4 per process), virtual nodes per shard,
+# and target nameservers per second for the whole run, split over the processes (None for unlimited)
+NSIP_SHARDS = None
+NSIP_VNODES = 64
+NSIP_TARGET_RATE = 1000
+# incremental sweep (nsrefresh.py): re-query a nameserver after max(TTL, stability interval) days,
+# the interval grows with the days since its addresses last changed, and query all every N days
+NSIP_INCREMENTAL = True
+NSIP_MIN_REFRESH_DAYS = 1
+NSIP_MAX_REFRESH_DAYS = 14
+NSIP_FULL_SWEEP_DAYS = 7
 
 # path to store TLSconnection measurement
 TLS_DIR = "/data/tlsconnect"
@@ -27,4 +52,56 @@ TLS_DIR = "/data/tlsconnect"
 MAXCONCURRENCY = 30
 
 # default DNS servers
-RESOLVER_LIST = ['8.8.8.8', '1.1.1.1']
\ No newline at end of file
+RESOLVER_LIST = ['8.8.8.8', '1.1.1.1']
+
+# query NS, SOA, A and AAAA of a domain concurrently once HTTPS answers
+QUERY_FANOUT = True
+
+# query backend: "dnspython" uses dns.asyncresolver,
+# "raw" sends wire queries over a shared pool of long-lived UDP sockets (dnsengine.py)
+QUERY_BACKEND = "dnspython"
+RAW_UDP_SOCKETS = 4     # sockets per upstream resolver
+RAW_QUERY_TIMEOUT = 2   # seconds per attempt, bounded by the resolver lifetime
+
+# adaptive (AIMD) concurrency, starts at MAXCONCURRENCY and moves between the bounds below (limiter.py)
+ADAPTIVE_CONCURRENCY = True
+MIN_CONCURRENCY = 10
+MAX_ADAPTIVE_CONCURRENCY = 300
+ADAPTIVE_FAILURE_RATE = 0.1     # back off when more timeouts/SERVFAILs than this share of queries
+ADAPTIVE_LATENCY_FACTOR = 2     # back off when mean latency exceeds this multiple of the baseline
+
+# spread queries over every resolver in RESOLVER_LIST instead of always trying them in order (resolverpool.py)
+RESOLVER_BALANCE = True
+RESOLVER_QPS = {'8.8.8.8': 500, '1.1.1.1': 500}  # queries per second per upstream and per worker process
+RESOLVER_DEFAULT_QPS = 200
+RESOLVER_EJECT_RATE = 0.5       # eject an upstream when more than half of its recent queries fail
+RESOLVER_EJECT_SECONDS = 30
+
+# in-run answer cache in front of the resolvers (dnscache.py)
+ANSWER_CACHE = True
+ANSWER_CACHE_QTYPES = ["NS", "SOA"]
+ANSWER_CACHE_SIZE = 50000       # entries per process
+ANSWER_CACHE_MAX_TTL = 3600     # seconds
+
+# answer cache shared by all worker processes through a local sqlite file,
+# multiproc_query.py --shared-cache keeps it under DATAROOT_DIR/<date> instead
+SHARED_CACHE = False
+SHARED_CACHE_PATH = "/data/cache/dnscache.sqlite"
+# new answers are written in one transaction every N entries or T seconds, and a lookup
+# gives up on a locked file after BUSY ms (counted as a miss) instead of stalling the event loop
+SHARED_CACHE_FLUSH_ENTRIES = 500
+SHARED_CACHE_FLUSH_SECONDS = 2
+SHARED_CACHE_BUSY_MS = 20
+
+# TLS probes to servers with mismatched IPs (asyncTLSconnection.py)
+TLS_MAXCONCURRENCY = 20
+TLS_TIMEOUT = 10    # seconds per connection and handshake
+TLS_ALPN = ["h2", "http/1.1"]
+
+# raw query output: "wire" writes length-prefixed DNS wire records (rawstore.py), "pickle" pickles Domain objects
+RAW_FORMAT = "wire"
+
+# streaming raw record writer: hand buffered records to the writer thread every N records,
+# and fsync at most every this many seconds
+STREAM_FLUSH_RECORDS = 200
+STREAM_FSYNC_SECONDS = 5
@@ -0,0 +1,126 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+
+"""
+schema of the measurement databases (history.db and NameServerIP.db).
+
+every table keys one row per name with the day it was first and last seen:
+
+    apexhistory (apex TEXT PRIMARY KEY, first_seen TEXT, last_seen TEXT)
+    wwwhistory  (www TEXT PRIMARY KEY, first_seen TEXT, last_seen TEXT)
+    nameservers (nameserver TEXT PRIMARY KEY, first_seen TEXT, last_seen TEXT)
+
+days are %Y-%m-%d strings, so they compare in date order. connect() creates missing tables,
+migrates tables created without primary key (duplicates are merged, keeping the first
+first_seen and the last last_seen) and records the schema version in PRAGMA user_version.
+
+versions:
+    1  primary key on the name
+    2  nameserver names lowercase with a trailing dot, as written by scpt_nsIP_query
+"""
+
+SCHEMA_VERSION = 2
+
+# table -> key column
+HIST_TABLES = {"apexhistory": "apex", "wwwhistory": "www"}
+NSIP_TABLES = {"nameservers": "nameserver"}
+
+PRAGMAS = ["PRAGMA journal_mode=WAL",
+           "PRAGMA synchronous=NORMAL",
+           "PRAGMA temp_store=MEMORY",
+           "PRAGMA cache_size=-65536",       # 64MB page cache
+           "PRAGMA mmap_size=268435456"]
+
+
+def _create_table(conn: sqlite3.Connection, table: str, key: str):
+    conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} ({key} TEXT PRIMARY KEY, first_seen TEXT, last_seen TEXT)""")
+
+
+def _migrate_table(conn: sqlite3.Connection, table: str, key: str):
+    """rebuild a table created without primary key, merging duplicate names"""
+    info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    if len(info) == 0:
+        _create_table(conn, table, key)
+        return
+    if any([col[1] == key and col[5] == 1 for col in info]):
+        return
+
+    names = [col[1] for col in info]
+    print("Migrate table:", table, names)
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    _create_table(conn, table, key)
+    conn.execute(f"""INSERT INTO {table} SELECT {names[0]}, MIN({names[1]}), MAX({names[2]})
+                     FROM {table}_old GROUP BY {names[0]}""")
+    conn.execute(f"DROP TABLE {table}_old")
+
+
+def _normalize_nameservers(conn: sqlite3.Connection, table: str, key: str):
+    """merge the rows of names that only differ in case or trailing dot into the normalized name"""
+    print("Normalize names:", table)
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    _create_table(conn, table, key)
+    conn.execute(f"""INSERT INTO {table} SELECT lower(rtrim({key}, '.')) || '.', MIN(first_seen), MAX(last_seen)
+                     FROM {table}_old GROUP BY lower(rtrim({key}, '.'))""")
+    conn.execute(f"DROP TABLE {table}_old")
+
+
+def ensure_schema(conn: sqlite3.Connection, tables: dict):
+    """create or migrate the tables and their last_seen indexes"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    with conn:
+        for table, key in tables.items():
+            if version < 1:
+                _migrate_table(conn, table, key)
+            else:
+                _create_table(conn, table, key)
+            if version < 2 and table in NSIP_TABLES:
+                _normalize_nameservers(conn, table, key)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_seen_idx ON {table} (last_seen)")
+    if version < SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+
+def connect(dbfpath: str, tables: dict) -> sqlite3.Connection:
+    """open a measurement database with the tuned pragmas and an up to date schema"""
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    ensure_schema(conn, tables)
+    return conn
+
+
+def active_since(active_days: int, logday: str = None) -> str:
+    """first day of the window of active_days days that ends on logday (default today)"""
+    end = datetime.datetime.now() if logday is None else datetime.datetime.strptime(logday, "%Y-%m-%d")
+    return (end - datetime.timedelta(days=active_days - 1)).strftime("%Y-%m-%d")
+
+
+def read_table(conn: sqlite3.Connection, table: str, active_days: int = None, logday: str = None) -> pd.DataFrame:
+    """
+    rows of a table as a DataFrame; with active_days, only the names last seen in the
+    last active_days days (through the last_seen index)
+    """
+    if active_days is None:
+        return pd.read_sql_query(f"SELECT * FROM {table}", conn)
+    return pd.read_sql_query(f"SELECT * FROM {table} WHERE last_seen >= ?", conn,
+                             params=(active_since(active_days, logday),))
+
+
+def upsert_seen(conn: sqlite3.Connection, table: str, names, logday: str) -> int:
+    """
+    add the names seen on logday to table, or move their last_seen to logday.
+    the names are bulk loaded into a temp table and merged with a single INSERT ... ON CONFLICT.
+    returns the number of rows inserted or updated.
+    """
+    key = {**HIST_TABLES, **NSIP_TABLES}[table]
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_names (name TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM seen_names")
+    conn.executemany("INSERT OR IGNORE INTO seen_names VALUES (?)", ((name,) for name in names))
+
+    # WHERE true lets sqlite parse the ON CONFLICT clause after a SELECT
+    cur = conn.execute(f"""INSERT INTO {table} SELECT name, ?, ? FROM seen_names WHERE true
+                           ON CONFLICT ({key}) DO UPDATE SET last_seen=excluded.last_seen""", (logday, logday))
+    return cur.rowcount
+
@@ -0,0 +1,295 @@
+import asyncio
+import collections
+import os
+import sqlite3
+import time
+
+import dns
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+# local import
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_MAX_TTL, ANSWER_CACHE_QTYPES, SHARED_CACHE, SHARED_CACHE_PATH
+from config import SHARED_CACHE_FLUSH_ENTRIES, SHARED_CACHE_FLUSH_SECONDS, SHARED_CACHE_BUSY_MS
+
+
+class AnswerCache:
+    """
+    size bounded LRU cache of DNS answers keyed by (qname, qtype).
+    every entry expires after the TTL of its answer, capped at `max_ttl` seconds.
+    """
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, max_ttl: float = ANSWER_CACHE_MAX_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expiration = entry
+        if expiration < time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple, value, ttl: float):
+        if ttl <= 0:
+            return
+        self.entries[key] = (value, time.time() + min(ttl, self.max_ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def cache_key(qname, rdtype) -> tuple:
+    if isinstance(qname, str):
+        qname = dns.name.from_text(qname)
+    return (qname.to_text().lower(), dns.rdatatype.to_text(dns.rdatatype.RdataType.make(rdtype)))
+
+
+class CachingResolver:
+    """
+    resolver wrapper that answers repeated questions of the cached query types from an AnswerCache.
+    identical questions in flight at the same time share one upstream query.
+    resolve() follows dns.asyncresolver.Resolver.resolve.
+    """
+    def __init__(self, resolver, cache: AnswerCache, qtypes: list = ANSWER_CACHE_QTYPES):
+        self.resolver = resolver
+        self.cache = cache
+        self.qtypes = set(qtypes)
+        self.inflight = {}
+
+    async def resolve(self, qname, rdtype="A", rdclass=dns.rdataclass.IN,
+                      raise_on_no_answer: bool = True) -> dns.resolver.Answer:
+        key = cache_key(qname, rdtype)
+        if key[1] not in self.qtypes:
+            return await self.resolver.resolve(qname, rdtype, rdclass=rdclass, raise_on_no_answer=raise_on_no_answer)
+
+        answer = self.cache.get(key)
+        if answer is None:
+            fut = self.inflight.get(key)
+            if fut is not None:
+                answer = await asyncio.shield(fut)
+            else:
+                fut = asyncio.get_running_loop().create_future()
+                self.inflight[key] = fut
+                try:
+                    answer = await self.resolver.resolve(qname, rdtype, rdclass=rdclass, raise_on_no_answer=False)
+                    self.cache.put(key, answer, answer.chaining_result.minimum_ttl)
+                    fut.set_result(answer)
+                except asyncio.CancelledError:
+                    fut.cancel()
+                    raise
+                except Exception as err:
+                    fut.set_exception(err)
+                    fut.exception() # mark as retrieved when nobody else is waiting
+                    raise err
+                finally:
+                    del self.inflight[key]
+
+        if answer.rrset is None and raise_on_no_answer:
+            raise dns.resolver.NoAnswer(response=answer.response)
+        return answer
+
+
+class SharedAnswerCache(AnswerCache):
+    """
+    AnswerCache backed by a local sqlite file that every process of the pool consults and populates.
+    the in-process LRU stays in front of it; answers are stored as wire bytes with their expiration.
+    the sqlite calls run on the event loop thread, so they must not wait: new answers are buffered and
+    written in one transaction every `flush_entries` entries or `flush_seconds` seconds, and a file
+    locked by another process for more than `busy_ms` is a miss (lookup) or a later retry (write).
+    each process opens its own connection lazily, so the object can be inherited through fork.
+    """
+    def __init__(self, dbfpath: str, maxsize: int = ANSWER_CACHE_SIZE, max_ttl: float = ANSWER_CACHE_MAX_TTL,
+                 flush_entries: int = SHARED_CACHE_FLUSH_ENTRIES, flush_seconds: float = SHARED_CACHE_FLUSH_SECONDS,
+                 busy_ms: int = SHARED_CACHE_BUSY_MS):
+        super().__init__(maxsize, max_ttl)
+        self.dbfpath = dbfpath
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self.busy_ms = busy_ms
+        self.conn = None
+        self.pid = None
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.shared_hits = 0
+        self.locked = 0
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.dbfpath, timeout=30, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=OFF")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS answers (qname TEXT, qtype TEXT, expiration REAL, 
+                                 nameserver TEXT, wire BLOB, PRIMARY KEY (qname, qtype)) WITHOUT ROWID""")
+            # the setup above may wait, the lookups and writes of the run may not
+            self.conn.execute(f"PRAGMA busy_timeout={self.busy_ms}")
+            self.pid = os.getpid()
+            self.pending = []
+        return self.conn
+
+    def get(self, key: tuple):
+        value = super().get(key)
+        if value is not None:
+            return value
+
+        try:
+            row = self.connect().execute("""SELECT expiration, nameserver, wire FROM answers 
+                                            WHERE qname=? AND qtype=? AND expiration>?""", (*key, time.time())).fetchone()
+        except sqlite3.OperationalError: # locked by another process
+            self.locked += 1
+            return None
+        if row is None:
+            return None
+        expiration, nameserver, wire = row
+        qname = dns.name.from_text(key[0])
+        response = dns.message.from_wire(wire)
+        value = dns.resolver.Answer(qname, dns.rdatatype.from_text(key[1]), dns.rdataclass.IN, response, nameserver)
+        super().put(key, value, expiration - time.time())
+        self.shared_hits += 1
+        return value
+
+    def put(self, key: tuple, value, ttl: float):
+        super().put(key, value, ttl)
+        if ttl <= 0:
+            return
+        self.connect()
+        self.pending.append((*key, time.time() + min(ttl, self.max_ttl), value.nameserver, value.response.to_wire()))
+        if len(self.pending) >= self.flush_entries or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """write the buffered answers in one transaction, keep them for the next flush if the file is locked"""
+        if len(self.pending) == 0:
+            return
+        conn = self.connect()
+        self.last_flush = time.monotonic()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO answers VALUES (?,?,?,?,?)", self.pending)
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.locked += 1
+            # the local LRU still holds them, do not let the buffer grow without bound
+            self.pending = self.pending[-10 * self.flush_entries:]
+            return
+        self.pending = []
+
+    def purge_expired(self):
+        self.connect().execute("DELETE FROM answers WHERE expiration<=?", (time.time(),))
+
+    def stats(self) -> dict:
+        res = super().stats()
+        res["shared_hits"] = self.shared_hits
+        res["locked"] = self.locked
+        return res
+
+
+# one cache per process, shared by every resolver created through asyncquery.get_resolver
+_ANSWER_CACHE = None
+# name -> zone, filled by zone_for_name
+_ZONE_CACHE = None
+# CNAME hops and HTTPS answers of CNAME targets, filled by asyncquery.query_https_rec
+_CNAME_CACHE = None
+# sqlite file of the cross-process cache, None for a process-local cache
+_SHARED_CACHE_PATH = SHARED_CACHE_PATH if SHARED_CACHE else None
+
+
+def enable_shared_cache(dbfpath: str):
+    """
+    back the answer cache with a sqlite file shared by all processes.
+    call in the parent before the multiprocessing pool starts, the workers inherit the setting.
+    """
+    global _SHARED_CACHE_PATH, _ANSWER_CACHE
+    _SHARED_CACHE_PATH = dbfpath
+    _ANSWER_CACHE = None
+    cache = get_answer_cache()
+    cache.purge_expired()
+    cache.conn.close()
+    cache.conn = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _ANSWER_CACHE
+    if _ANSWER_CACHE is None:
+        if _SHARED_CACHE_PATH is not None:
+            _ANSWER_CACHE = SharedAnswerCache(_SHARED_CACHE_PATH)
+        else:
+            _ANSWER_CACHE = AnswerCache()
+    return _ANSWER_CACHE
+
+
+def get_zone_cache() -> AnswerCache:
+    global _ZONE_CACHE
+    if _ZONE_CACHE is None:
+        _ZONE_CACHE = AnswerCache()
+    return _ZONE_CACHE
+
+
+def get_cname_cache() -> AnswerCache:
+    global _CNAME_CACHE
+    if _CNAME_CACHE is None:
+        _CNAME_CACHE = AnswerCache()
+    return _CNAME_CACHE
+
+
+def _zone_from_authority(response, name: dns.name.Name):
+    """the zone named by an SOA in the authority section of a negative answer, if it is above name"""
+    if response is None:
+        return None
+    for rrs in response.authority:
+        if rrs.rdtype == dns.rdatatype.SOA and rrs.rdclass == dns.rdataclass.IN:
+            (relation, _, _) = rrs.name.fullcompare(name)
+            if relation == dns.name.NAMERELN_SUPERDOMAIN:
+                return rrs.name
+    return None
+
+
+async def zone_for_name(name, resolver) -> dns.name.Name:
+    """
+    asynchronous replacement for dns.resolver.zone_for_name, using the given resolver
+    (and through it the answer cache) instead of a blocking system resolver.
+    results are memoized per name.
+    """
+    if isinstance(name, str):
+        name = dns.name.from_text(name)
+    zones = get_zone_cache()
+    key = (name.to_text().lower(), "ZONE")
+    zone = zones.get(key)
+    if zone is not None:
+        return zone
+
+    candidate = name
+    while True:
+        try:
+            answer = await resolver.resolve(candidate, "SOA", raise_on_no_answer=False)
+            if answer.rrset is not None and answer.rrset.name == candidate:
+                zone = candidate
+            else: # NODATA, or CNAMEd/DNAMEd somewhere else
+                zone = _zone_from_authority(answer.response, candidate)
+        except dns.resolver.NXDOMAIN as err:
+            zone = _zone_from_authority(err.responses().get(candidate), candidate)
+
+        if zone is not None:
+            zones.put(key, zone, zones.max_ttl)
+            return zone
+        candidate = candidate.parent() # raises dns.name.NoParent above the root
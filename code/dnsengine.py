@@ -0,0 +1,221 @@
+import asyncio
+import random
+import struct
+import time
+
+import dns
+import dns.asyncquery
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+# local import
+from config import RAW_UDP_SOCKETS, RAW_QUERY_TIMEOUT
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """
+    datagram protocol of one long-lived UDP socket,
+    hands every response to the future waiting for its query ID
+    """
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12: # shorter than a dns header, ignore
+            return
+        qid = struct.unpack("!H", data[:2])[0]
+        fut = self.pending.pop(qid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(data)
+
+    def error_received(self, exc):
+        # icmp errors cannot be mapped to a query id, waiting queries will time out
+        pass
+
+    def connection_lost(self, exc):
+        for fut in self.pending.values():
+            if not fut.done():
+                fut.set_exception(exc if exc is not None else ConnectionError("UDP socket closed"))
+        self.pending.clear()
+
+
+class UDPSocketPool:
+    """
+    small pool of connected UDP sockets to one upstream resolver.
+    queries are spread over the sockets round robin and matched to responses by query ID.
+    """
+    def __init__(self, address: str, port: int = 53, size: int = RAW_UDP_SOCKETS):
+        self.address = address
+        self.port = port
+        self.size = size
+        self.protocols = []
+        self.__cursor__ = 0
+        self.__lock__ = None
+
+    async def open(self):
+        if self.__lock__ is None:
+            self.__lock__ = asyncio.Lock()
+        async with self.__lock__:
+            if len(self.protocols) > 0:
+                return
+            loop = asyncio.get_running_loop()
+            for _ in range(self.size):
+                transport, protocol = await loop.create_datagram_endpoint(_UDPProtocol,
+                                                                          remote_addr=(self.address, self.port))
+                self.protocols.append(protocol)
+
+    def close(self):
+        for protocol in self.protocols:
+            if protocol.transport is not None:
+                protocol.transport.close()
+        self.protocols = []
+
+    async def send(self, query: dns.message.Message, timeout: float) -> bytes:
+        """send the query over one of the sockets and return the raw response bytes"""
+        if len(self.protocols) == 0:
+            await self.open()
+        protocol = self.protocols[self.__cursor__ % len(self.protocols)]
+        self.__cursor__ += 1
+
+        # pick an ID that is not in flight on this socket
+        qid = random.randint(0, 65535)
+        while qid in protocol.pending:
+            qid = random.randint(0, 65535)
+        query.id = qid
+
+        fut = asyncio.get_running_loop().create_future()
+        protocol.pending[qid] = fut
+        try:
+            protocol.transport.sendto(query.to_wire())
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            protocol.pending.pop(qid, None)
+
+
+# socket pools are shared by every RawResolver of the same event loop
+_SOCKET_POOLS = {}
+
+
+def get_socket_pool(address: str, port: int = 53) -> UDPSocketPool:
+    """return the shared socket pool of the running event loop for address:port"""
+    loop = asyncio.get_running_loop()
+    key = (id(loop), address, port)
+    pool = _SOCKET_POOLS.get(key)
+    if pool is None:
+        pool = UDPSocketPool(address, port)
+        _SOCKET_POOLS[key] = pool
+    return pool
+
+
+def close_socket_pools():
+    """close every shared socket, call before closing the event loop"""
+    for pool in _SOCKET_POOLS.values():
+        pool.close()
+    _SOCKET_POOLS.clear()
+
+
+class RawResolver:
+    """
+    DNS query backend that sends pre-built dns.message queries over the shared
+    UDP socket pools and falls back to TCP when the response is truncated.
+    resolve() follows dns.asyncresolver.Resolver.resolve, so it can be used
+    anywhere get_resolver() is.
+    """
+    def __init__(self, nameservers: list, lifetime: float = 5, payload: int = 1420,
+                 flags: int = dns.flags.RD, ednsflags: int = dns.flags.DO, port: int = 53,
+                 timeout: float = RAW_QUERY_TIMEOUT):
+        self.nameservers = list(nameservers)
+        self.lifetime = lifetime
+        self.timeout = timeout
+        self.payload = payload
+        self.flags = flags
+        self.ednsflags = ednsflags
+        self.port = port
+        self.__cursor__ = 0
+
+    def make_query(self, qname: dns.name.Name, rdtype: dns.rdatatype.RdataType) -> dns.message.QueryMessage:
+        query = dns.message.make_query(qname, rdtype, use_edns=0, ednsflags=self.ednsflags, payload=self.payload)
+        query.flags = self.flags
+        return query
+
+    async def send_query(self, query: dns.message.QueryMessage, nameserver: str, timeout: float) -> dns.message.Message:
+        """send one query over UDP, re-send over TCP if the answer is truncated"""
+        wire = await get_socket_pool(nameserver, self.port).send(query, timeout)
+        response = dns.message.from_wire(wire, keyring=query.keyring, request_mac=query.mac,
+                                         ignore_trailing=True, raise_on_truncation=False)
+        if not query.is_response(response):
+            raise dns.query.BadResponse
+        if response.flags & dns.flags.TC:
+            response = await dns.asyncquery.tcp(query, nameserver, timeout=timeout, port=self.port)
+        return response
+
+    async def resolve(self, qname, rdtype="A", rdclass=dns.rdataclass.IN,
+                      raise_on_no_answer: bool = True) -> dns.resolver.Answer:
+        if isinstance(qname, str):
+            qname = dns.name.from_text(qname)
+        rdtype = dns.rdatatype.RdataType.make(rdtype)
+        rdclass = dns.rdataclass.RdataClass.make(rdclass)
+        query = self.make_query(qname, rdtype)
+
+        start = time.time()
+        nameservers = self.nameservers[self.__cursor__:] + self.nameservers[:self.__cursor__]
+        self.__cursor__ = (self.__cursor__ + 1) % len(self.nameservers)
+        errors = []
+
+        # like dnspython: servers that answer badly are dropped, timeouts are retried until the lifetime expires
+        while len(nameservers) > 0:
+            for nameserver in list(nameservers):
+                remaining = self.lifetime - (time.time() - start)
+                if remaining <= 0:
+                    raise dns.resolver.LifetimeTimeout(timeout=time.time() - start, errors=errors)
+                try:
+                    response = await self.send_query(query, nameserver, min(self.timeout, remaining))
+                except dns.exception.Timeout as err:
+                    errors.append((nameserver, False, self.port, err, None))
+                    continue
+                except Exception as err:
+                    errors.append((nameserver, False, self.port, err, None))
+                    nameservers.remove(nameserver)
+                    continue
+
+                rcode = response.rcode()
+                if rcode == dns.rcode.NXDOMAIN:
+                    raise dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+                if rcode == dns.rcode.YXDOMAIN:
+                    raise dns.resolver.YXDOMAIN
+                if rcode != dns.rcode.NOERROR: # SERVFAIL, REFUSED, ...
+                    errors.append((nameserver, False, self.port, dns.rcode.to_text(rcode), response))
+                    nameservers.remove(nameserver)
+                    continue
+
+                answer = dns.resolver.Answer(qname, rdtype, rdclass, response, nameserver, self.port)
+                if answer.rrset is None and raise_on_no_answer:
+                    raise dns.resolver.NoAnswer(response=response)
+                return answer
+
+        raise dns.resolver.NoNameservers(request=query, errors=errors)
+
+
+def get_raw_resolver(addresses: list, lifetime=5, payload=1420, AuthenticData=False) -> RawResolver:
+    """
+    Return RawResolver configured like asyncquery.get_resolver:
+    DO=1, RD=1, AD if requested, and EDNS payload for queries to the resolver.
+    """
+    if AuthenticData == True:
+        flags = dns.flags.RD | dns.flags.AD
+    else:
+        flags = dns.flags.RD
+    return RawResolver(addresses, lifetime=lifetime, payload=payload, flags=flags, ednsflags=dns.flags.DO)
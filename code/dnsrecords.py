@@ -4,12 +4,55 @@ import dns.rdtypes.IN.HTTPS
 import dns.rdtypes.ANY.RRSIG
 import base64
 import json
+import struct
+
+def _svcb_text(value):
+    return value.to_text().strip('"')
+
+
+def _svcb_utf8(value):
+    """text parameter that dnspython may leave as a GenericParam holding raw bytes"""
+    if isinstance(getattr(value, "value", None), bytes):
+        return value.value.decode("utf-8", errors="replace")
+    return _svcb_text(value)
+
+
+def _svcb_uint16_list(value) -> list:
+    data = value.value
+    return list(struct.unpack("!%dH" % (len(data) // 2), data[: len(data) // 2 * 2]))
+
+
+def _svcb_docpath(value) -> list:
+    """path segments; older dnspython leaves key10 as a GenericParam of length-prefixed segments"""
+    segments = getattr(value, "ids", None)
+    if segments is None:
+        data = value.value
+        segments = []
+        idx = 0
+        while idx < len(data):
+            segments.append(data[idx + 1: idx + 1 + data[idx]])
+            idx += 1 + data[idx]
+    return [seg.decode("utf-8", errors="replace") for seg in segments]
+
+
+def _svcb_raw_hex(value) -> str:
+    """value of a key nobody registered a parser for"""
+    if value is None:
+        return None
+    if isinstance(getattr(value, "value", None), bytes):
+        return value.value.hex()
+    return value.to_wire().hex() if hasattr(value, "to_wire") else _svcb_text(value)
+
 
 class SVCBRecord:
     """
     Class to parse SVCB records
     reference: https://dnspython.readthedocs.io/en/stable/_modules/dns/rdtypes/svcbbase.html
     reference : https://datatracker.ietf.org/doc/draft-ietf-dnsop-svcb-https/
+    reference: https://www.iana.org/assignments/dns-svcb/dns-svcb.xhtml
+
+    params_map and params_parser form the registry of SVCB keys, extend both with register_param().
+    keys without an entry are kept as "key<N>" with their raw value in hex.
     """
     params_map = {0: "mandatory", 
                   1: "alph", 
@@ -17,99 +60,88 @@ class SVCBRecord:
                   3: "port",
                   4: "ipv4hint", 
                   5: "ech",
-                  6: "ipv6hint"}
+                  6: "ipv6hint",
+                  7: "dohpath",
+                  8: "ohttp",
+                  9: "tls-supported-groups",
+                  10: "docpath"}
+
+    # key -> value converter, looked up once per parameter
+    params_parser = {0: lambda value: value.keys,   # mandatory
+                     1: _svcb_text,                 # alph
+                     2: lambda value: None,         # no-default-alph
+                     3: lambda value: value.port,   # port
+                     4: _svcb_text,                 # ipv4hint
+                     5: _svcb_text,                 # ech
+                     6: _svcb_text,                 # ipv6hint
+                     7: _svcb_utf8,                 # dohpath, RFC 9461
+                     8: lambda value: None,         # ohttp, RFC 9540
+                     9: _svcb_uint16_list,          # tls-supported-groups
+                     10: _svcb_docpath}             # docpath
     
     def __init__(self, svcbrr):
         self.parsed = self.parse_rec(svcbrr)
 
+    @classmethod
+    def register_param(cls, key: int, name: str, parser):
+        """decode SVCB key `key` as `name` with parser(value)"""
+        cls.params_map[key] = name
+        cls.params_parser[key] = parser
+
     def parse_rec(self, svcbrr: dns.immutable.Dict) -> dict:
-        try:
-            svcb_dict = svcbrr._odict
-            res = {}
-            for key, value in svcb_dict.items():
-                mapped_key = self.params_map[key]
-                parsed_value = self.__get_svcb_attr__(key, value)
-                res[mapped_key] = parsed_value
-            return res
-        except Exception as err:
-            raise err
+        res = {}
+        for key, value in svcbrr._odict.items():
+            parser = self.params_parser.get(key)
+            if parser is None:
+                res["key{}".format(int(key))] = _svcb_raw_hex(value)
+            else:
+                res[self.params_map[key]] = parser(value)
+        return res
     
     def __get_svcb_attr__(self, svcb_key, svcb_value):
-        try:
-            match svcb_key:
-                case 0: # mandatory
-                    return svcb_value.keys
-                case 1: # alph
-                    return svcb_value.to_text().strip('"')
-                case 2: # no-default-alph
-                    return None
-                case 3: # port
-                    return svcb_value.port
-                case 4: # ipv4hint
-                    return svcb_value.to_text().strip('"')
-                case 5: # ech
-                    return svcb_value.to_text().strip('"')
-                case 6: # ipv6hint
-                    return svcb_value.to_text().strip('"')
-                case _:
-                    raise ValueError("SVCB Key Not Correct.")
-        except Exception as err:
-            raise err
-    """
-    def __to_str__(self, item):
-        if item.__class__ == bytes:
-            #return item.decode()
-            return base64.b64encode(item).decode('utf-8')
-        if item.__class__ in [str, int, float]:
-            return item
- 
-    def __tuple_check__(self, tp):
-        if tp.__class__ == tuple:
-            tmp = []
-            for i in tp:
-                tmp.append(self.__to_str__(i))
-            return tuple(tmp)
-        
-        if tp.__class__ == bytes:
-            return self.__to_str__(tp)
-        
-        return tp
-    """  
+        parser = self.params_parser.get(svcb_key, _svcb_raw_hex)
+        return parser(svcb_value)
+
             
 class RRSIGRecords:
     """
     Class to parse RRSIG records
     reference: https://dnspython.readthedocs.io/en/stable/_modules/dns/rdtypes/ANY/RRSIG.html#RRSIG
     """
+    # rdata class -> ((attribute, converter), ...), the public data attributes of the class
+    # as dir() lists them, resolved once per class instead of once per signature
+    fields_cache = {}
+
+    converters = {"algorithm": lambda value: value.name,
+                  "rdclass": lambda value: value.name,
+                  "rdtype": lambda value: value.name,
+                  "type_covered": lambda value: value.name,
+                  "signer": lambda value: value.to_text(),
+                  "signature": lambda value: base64.b64encode(value).decode('utf-8')}
     
     def __init__(self, rrsig):
         self.parsed = self.parse_rec(rrsig)
 
-    def parse_rec(self, rrsig: dns.rdtypes.ANY.RRSIG.RRSIG) -> dict:
-        try:
+    @classmethod
+    def get_fields(cls, rrsig: dns.rdtypes.ANY.RRSIG.RRSIG) -> tuple:
+        fields = cls.fields_cache.get(rrsig.__class__)
+        if fields is None:
             ## get dns.rdtypes.ANY.RRSIG.RRSIG class variables 
             attributes = [v for v in dir(rrsig) if not callable(getattr(rrsig, v)) and v[0] != '_']
-            
-            res = {}
-            for attr in attributes:
-                parsed_value = self.__get_rrsig_attr__(attr, getattr(rrsig, attr))
-                res[attr] = parsed_value
-            return res
-        except Exception as err:
-            raise err
+            fields = tuple([(attr, cls.converters.get(attr)) for attr in attributes])
+            cls.fields_cache[rrsig.__class__] = fields
+        return fields
+
+    def parse_rec(self, rrsig: dns.rdtypes.ANY.RRSIG.RRSIG) -> dict:
+        res = {}
+        for attr, converter in self.get_fields(rrsig):
+            value = getattr(rrsig, attr)
+            res[attr] = converter(value) if converter is not None else value
+        return res
 
     def __get_rrsig_attr__(self, rrsig_attr, rrsig_value):
-        try:
-            if rrsig_attr in ['algorithm', 'rdclass', 'rdtype', 'type_covered']:
-                return rrsig_value.name
-            elif rrsig_attr == 'signer':
-                return rrsig_value.to_text()
-            elif rrsig_attr == 'signature':
-                return base64.b64encode(rrsig_value).decode('utf-8')
-            else:
-                return rrsig_value
-        except Exception as err:
-            raise err
+        converter = self.converters.get(rrsig_attr)
+        return converter(rrsig_value) if converter is not None else rrsig_value
         
 class HTTPSRecord:
     """
@@ -171,6 +203,8 @@ class HTTPSAnswer:
         for rr in msg.answer:
             if rr.rdtype == 5: # skip CNAME
                 continue
+            if rr.rdtype == 46 and rr.covers == 5: # skip signatures of the CNAME chain
+                continue
             tmpres = self.__parse_by_type__(rr)
             res.update(tmpres)
         
@@ -315,4 +349,45 @@ class SOAAnswer:
         res = {"SOA": soainfo}
             
         self.nameservers = json.dumps(res)
-        return json.dumps(res) 
\ No newline at end of file
+        return json.dumps(res) 
+
+
+class LazyAnswer:
+    """
+    read-only view over a stored DNS response that decodes the wire format only when a consumer asks for it.
+    header fields are read straight from the wire, an empty answer section never decodes the message,
+    other attributes fall through to the decoded dns.message.Message, so the view can stand in
+    for it in Domain.message.
+    """
+    HEADER = struct.Struct("!HHHHHH")
+
+    def __init__(self, wire: bytes):
+        self.wire = wire
+        self._msg = None
+        (self.id, self.flags, self.qdcount, self.ancount, self.nscount, self.arcount) = self.HEADER.unpack_from(wire)
+
+    def rcode(self) -> int:
+        if self._msg is not None or self.arcount > 0: # extended rcode needs the OPT record
+            return self.message.rcode()
+        return self.flags & 0xF
+
+    @property
+    def message(self) -> dns.message.Message:
+        if self._msg is None:
+            self._msg = dns.message.from_wire(self.wire, ignore_trailing=True)
+        return self._msg
+
+    @property
+    def answer(self) -> list:
+        if self.ancount == 0:
+            return []
+        return self.message.answer
+
+    def to_wire(self) -> bytes:
+        return self.wire
+
+    def __getattr__(self, name):
+        if name.startswith("_"): # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.message, name)
+
@@ -0,0 +1,35 @@
+import bisect
+import hashlib
+
+# local import
+from config import NSIP_VNODES
+
+
+def stable_hash(key: str) -> int:
+    """64 bit hash of a string that is the same in every process and run (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    consistent hash ring with `vnodes` virtual nodes per node.
+    a key always maps to the same node, and changing the number of nodes only moves
+    the keys of the ring segments that changed owner.
+    """
+    def __init__(self, nodes, vnodes: int = NSIP_VNODES):
+        self.points = sorted([(stable_hash(f"{node}#{idx}"), node) for node in nodes for idx in range(vnodes)])
+        self.hashes = [point[0] for point in self.points]
+
+    def node_for(self, key: str):
+        idx = bisect.bisect(self.hashes, stable_hash(key)) % len(self.points)
+        return self.points[idx][1]
+
+
+def shard_key(nameserver: str) -> str:
+    """
+    key a nameserver is sharded by: its parent domain, so that the nameservers of one
+    provider (ns1.example.net, ns2.example.net) share a shard and its cached delegations
+    """
+    name = nameserver.lower().rstrip(".")
+    parts = name.split(".", 1)
+    return parts[1] if len(parts) == 2 and "." in parts[1] else name
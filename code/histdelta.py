@@ -0,0 +1,155 @@
+import ast
+import json
+import sqlite3
+
+import pandas as pd
+
+# local import
+from config import HIST_DELTA_DB
+from dbschema import PRAGMAS
+
+"""
+change-only store of the daily NS/SOA history snapshots (scpt_hist_parsing).
+
+a row is written only when the NS, SOA or error of a domain differs from its previous observation,
+and stays valid until the next row of the domain:
+
+    nssoa_delta  (dtype TEXT, domain TEXT, valid_from TEXT, ns TEXT, soa TEXT, error TEXT,
+                  PRIMARY KEY (dtype, domain, valid_from))
+    nssoa_latest (dtype TEXT, domain TEXT, valid_from TEXT, ns TEXT, soa TEXT, error TEXT,
+                  PRIMARY KEY (dtype, domain))
+
+nssoa_latest mirrors the newest row of every domain so that a new snapshot is compared without
+scanning the history. a domain missing from a day's snapshot gets a tombstone row (ns and soa NULL,
+error ABSENT) so that it is not reported with its old state for the days it was not queried.
+ns and soa are the JSON strings of the parsed csv files with the record lists sorted, so that
+a reordered answer is not a change. days are %Y-%m-%d strings.
+"""
+
+DELTA_COLUMNS = ["dtype", "domain", "valid_from", "ns", "soa", "error"]
+# error of a tombstone row
+ABSENT = "absent"
+
+
+def connect(dbfpath: str = HIST_DELTA_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with conn:
+        for table, key in [("nssoa_delta", "dtype, domain, valid_from"), ("nssoa_latest", "dtype, domain")]:
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (dtype TEXT, domain TEXT, valid_from TEXT,
+                             ns TEXT, soa TEXT, error TEXT, PRIMARY KEY ({key})) WITHOUT ROWID""")
+    return conn
+
+
+def _canonical(value) -> str:
+    """JSON string with sorted record lists, None when missing"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    parsed = json.loads(value)
+    return json.dumps({key: sorted(items) if isinstance(items, list) else items
+                       for key, items in sorted(parsed.items())})
+
+
+def _error_text(error) -> str:
+    if isinstance(error, str):
+        error = ast.literal_eval(error)
+    return str(dict(sorted(error.items())))
+
+
+def record_snapshot(df: pd.DataFrame, logday: str, dtype: str, skipped=None, complete: bool = True,
+                    dbfpath: str = HIST_DELTA_DB) -> int:
+    """
+    store the domains of a parsed snapshot (columns domain, ns, soa, error) whose values changed
+    since their previous observation, and a tombstone for every tracked domain missing from it.
+    domains in skipped (e.g. failed to parse) are neither compared nor marked absent.
+    a snapshot that is not complete (interrupted query run) only records changes, no tombstones.
+    a day older than a domain's latest row is not merged into its history.
+    returns the number of rows written.
+    """
+    skipped = set() if skipped is None else set(skipped)
+    conn = connect(dbfpath)
+    latest = {row[0]: row[1:] for row in conn.execute(
+        "SELECT domain, valid_from, ns, soa, error FROM nssoa_latest WHERE dtype=?", (dtype,))}
+
+    rows = []
+    older = 0
+    seen = set(df["domain"])
+    for domain, ns, soa, error in zip(df["domain"], df["ns"], df["soa"], df["error"]):
+        if domain in skipped:
+            continue
+        value = (_canonical(ns), _canonical(soa), _error_text(error))
+        old = latest.get(domain)
+        if old is not None and old[0] > logday:
+            older += 1
+            continue
+        if old is not None and old[1:] == value:
+            continue
+        rows.append((dtype, domain, logday) + value)
+
+    absent = 0
+    for domain, old in latest.items():
+        if not complete:
+            break
+        if domain in seen or domain in skipped or old[3] == ABSENT or old[0] >= logday:
+            continue
+        rows.append((dtype, domain, logday, None, None, ABSENT))
+        absent += 1
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO nssoa_delta VALUES (?,?,?,?,?,?)", rows)
+        conn.executemany("INSERT OR REPLACE INTO nssoa_latest VALUES (?,?,?,?,?,?)", rows)
+    conn.close()
+    print("Delta rows:", len(rows), "of", len(df), "domains,", dtype, logday, ",absent:", absent)
+    if not complete:
+        print("WARNING: incomplete snapshot of", logday, ", missing domains are not marked absent")
+    if older > 0:
+        print("WARNING: skipped", older, "domains with history newer than", logday,
+              ", backfilling a day before the latest one is not supported")
+    return len(rows)
+
+
+def state_as_of(logday: str, dtype: str, domains: list = None, include_absent: bool = False,
+                dbfpath: str = HIST_DELTA_DB) -> pd.DataFrame:
+    """
+    NS/SOA state of the domains on logday: for every domain the newest row valid on that day.
+    domains whose newest row is a tombstone are left out unless include_absent.
+
+    Parameters
+    ----------
+    logday : %Y-%m-%d
+    dtype : apex or www
+    domains : domains to look up, all when None
+    include_absent : keep the tombstone rows (error ABSENT) of domains not observed on logday
+
+    Returns
+    -------
+    pd.DataFrame with DELTA_COLUMNS, valid_from is the day the state was first observed
+    """
+    conn = connect(dbfpath)
+    join = ""
+    if domains is not None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_domains (domain TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM lookup_domains")
+        conn.executemany("INSERT OR IGNORE INTO lookup_domains VALUES (?)", ((domain,) for domain in domains))
+        join = "JOIN lookup_domains USING (domain)"
+
+    # one index seek per domain through the (dtype, domain, valid_from) primary key
+    df = pd.read_sql_query(f"""SELECT d.* FROM nssoa_delta d
+                               JOIN (SELECT domain, MAX(valid_from) AS valid_from FROM nssoa_delta {join}
+                                     WHERE dtype=? AND valid_from<=? GROUP BY domain) s
+                               ON d.domain = s.domain AND d.valid_from = s.valid_from
+                               WHERE d.dtype=?""", conn, params=(dtype, logday, dtype))
+    conn.close()
+    if not include_absent:
+        df = df.loc[df["error"] != ABSENT].reset_index(drop=True)
+    return df
+
+
+def history_of(domain: str, dtype: str, dbfpath: str = HIST_DELTA_DB) -> pd.DataFrame:
+    """all changes of one domain, oldest first"""
+    conn = connect(dbfpath)
+    df = pd.read_sql_query("SELECT * FROM nssoa_delta WHERE dtype=? AND domain=? ORDER BY valid_from",
+                           conn, params=(dtype, domain))
+    conn.close()
+    return df
@@ -0,0 +1,119 @@
+import asyncio
+import collections
+
+# local import
+from config import (MAXCONCURRENCY, ADAPTIVE_CONCURRENCY, MIN_CONCURRENCY, MAX_ADAPTIVE_CONCURRENCY,
+                    ADAPTIVE_FAILURE_RATE, ADAPTIVE_LATENCY_FACTOR)
+
+# query errors that mean the resolvers are overloaded or rate limiting us
+OVERLOAD_ERRORS = {"Timeout", "LifetimeTimeout", "NoNameservers"}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter, used like asyncio.Semaphore (`async with limiter:`).
+    every window of observed queries, the in-flight limit grows by `step` while
+    timeouts and latency stay healthy, and is multiplied by `backoff` when the
+    timeout/SERVFAIL rate or the mean latency spikes.
+    """
+    def __init__(self, initial: int = MAXCONCURRENCY, minimum: int = MIN_CONCURRENCY,
+                 maximum: int = MAX_ADAPTIVE_CONCURRENCY, step: float = 2, backoff: float = 0.7,
+                 failure_rate: float = ADAPTIVE_FAILURE_RATE, latency_factor: float = ADAPTIVE_LATENCY_FACTOR):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.backoff = backoff
+        self.failure_rate = failure_rate
+        self.latency_factor = latency_factor
+
+        self.inflight = 0
+        self.waiters = collections.deque()
+
+        # statistics of the current window
+        self.baseline = None
+        self.samples = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+
+    async def acquire(self):
+        while self.inflight >= int(self.limit):
+            fut = asyncio.get_running_loop().create_future()
+            self.waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done(): # woken up but cancelled, pass the slot on
+                    self.__wake__()
+                else:
+                    self.waiters.remove(fut)
+                raise
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        self.__wake__()
+
+    def __wake__(self):
+        free = int(self.limit) - self.inflight
+        while free > 0 and len(self.waiters) > 0:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return None
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def observe(self, latency: float, failed: bool):
+        """record one finished query and adjust the limit at the end of a window"""
+        self.samples += 1
+        self.failures += int(failed)
+        self.latency_sum += latency
+        if self.samples < max(20, int(self.limit)):
+            return
+
+        mean = self.latency_sum / self.samples
+        rate = self.failures / self.samples
+        # the baseline follows the fastest window but may drift up slowly with the resolvers
+        if self.baseline is None:
+            self.baseline = mean
+        else:
+            self.baseline = min(mean, self.baseline * 1.05)
+
+        if rate > self.failure_rate or mean > self.latency_factor * self.baseline:
+            self.limit = max(self.minimum, self.limit * self.backoff)
+            print("LIMITER BACKOFF:", int(self.limit), ",FAILURE RATE:", round(rate, 3), ",MEAN LATENCY:", round(mean, 3))
+        else:
+            self.limit = min(self.maximum, self.limit + self.step)
+
+        self.samples = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+        self.__wake__()
+
+
+def get_semaphore():
+    """return the concurrency limiter for the query wrappers as configured in config.py"""
+    if ADAPTIVE_CONCURRENCY:
+        return AdaptiveLimiter()
+    return asyncio.Semaphore(MAXCONCURRENCY)
+
+
+def worker_count(sem) -> int:
+    """number of worker coroutines needed to keep the limiter busy"""
+    if isinstance(sem, AdaptiveLimiter):
+        return sem.maximum
+    return MAXCONCURRENCY
+
+
+def report_outcome(sem, domain, elapsed: float):
+    """feed the outcome of a domain query back to an adaptive limiter, no-op for plain semaphores"""
+    if not isinstance(sem, AdaptiveLimiter):
+        return
+    failed = any([err in OVERLOAD_ERRORS for err in domain.error.values()])
+    sem.observe(elapsed, failed)
@@ -10,14 +10,30 @@ import psutil
 import datetime
 import os
 import click
+import functools
 
 import multiprocessing
 import numpy as np
 
 from dnsrecords import *
+from rawstore import load_results, list_raw_files
+from parsedstore import write_parsed_parquet
+from config import PARSED_FORMAT
 
 
-def unpack_domain_obj(domain:Domain) -> pd.Series:
+# output columns, in the order of the csv files
+COLUMNS = ["version", "rank", "domain", "cname", "https", "ns", "a", "aaaa", "error", "soa"]
+ERROR_COLUMNS = ["domain", "runtimeErrorType", "runtimeErrorInfo", "fname", "runtimeError"]
+# parsed field -> query type of the message it is decoded from
+FIELD_QTYPES = {"https": "HTTPS", "ns": "NS", "soa": "SOA", "a": "A", "aaaa": "AAAA"}
+
+
+def unpack_domain_obj(domain:Domain, fields: list = None) -> dict:
+    """
+    parse the stored messages of a domain into one output row.
+    with fields, only those columns of FIELD_QTYPES are decoded and the others stay None;
+    domains with an empty HTTPS answer are only dropped when https is among the fields.
+    """
     version = "0.2"
     rank = domain.rank
     name = domain.name
@@ -34,8 +50,9 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
     #    return None
     
     res = None
+    qtypes = domain.message.keys() if fields is None else [FIELD_QTYPES[field] for field in fields]
     
-    if "HTTPS" in domain.message.keys():
+    if "HTTPS" in domain.message.keys() and "HTTPS" in qtypes:
         try:
             msg = domain.message["HTTPS"]
             tmp = HTTPSAnswer(msg)
@@ -45,7 +62,7 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
         except Exception as err:
             raise err
             
-    if "NS" in domain.message.keys():
+    if "NS" in domain.message.keys() and "NS" in qtypes:
         try:
             msg = domain.message["NS"]
             tmp = NSAnswer(msg)
@@ -54,7 +71,7 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
             raise err
             
     
-    if "SOA" in domain.message.keys():
+    if "SOA" in domain.message.keys() and "SOA" in qtypes:
         try:
             msg = domain.message["SOA"]
             tmp = SOAAnswer(msg)
@@ -62,7 +79,7 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
         except Exception as err:
             raise err
             
-    if "A" in domain.message.keys():
+    if "A" in domain.message.keys() and "A" in qtypes:
         try:
             msg = domain.message["A"]
             tmp = IPAnswer(msg)
@@ -70,7 +87,7 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
         except Exception as err:
             raise err
                 
-    if "AAAA" in domain.message.keys():
+    if "AAAA" in domain.message.keys() and "AAAA" in qtypes:
         try:
             msg = domain.message["AAAA"]
             tmp = IPAnswer(msg)
@@ -78,47 +95,51 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
         except Exception as err:
             raise err
     
-    res = pd.Series({"version": version, "rank": rank, "domain": name, "cname": cname,
-           "https": https, "ns": NS, "soa": SOA, "a": A, "aaaa": AAAA, "error": error})
+    res = {"version": version, "rank": rank, "domain": name, "cname": cname,
+           "https": https, "ns": NS, "soa": SOA, "a": A, "aaaa": AAAA, "error": error}
     return res
 
 
-def process_data(flist: list) -> pd.DataFrame:
-    df = pd.DataFrame(columns = ["version", "rank", "domain", "cname", "https", "ns", "a", "aaaa", "error"])
-    errdf = pd.DataFrame(columns = ["domain", "runtimeErrorType", "runtimeErrorInfo"])
+def process_data(flist: list, fields: list = None) -> pd.DataFrame:
+    rows = []
+    errors = []
+    # responses that are not projected are not even kept from the raw record files
+    qtypes = None if fields is None else [FIELD_QTYPES[field] for field in fields]
 
     for f in flist:
         print(f)
-        with open (f, 'rb') as infile:
-            domain_dict = pickle.load(infile)
+        domain_dict = load_results(f, qtypes=qtypes)
 
         for key, value in domain_dict.items():
             try:
                 #print(key, value)
-                res = unpack_domain_obj(value)
+                res = unpack_domain_obj(value, fields)
                 if res is None:
                     print(f, key, "EMPTY")
                     continue
-                df = pd.concat([df, res.to_frame().T], ignore_index=True)
+                rows.append(res)
             except Exception as err:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
-                errdf = pd.concat([errdf, pd.Series({"fname": f, "domain":key, "runtimeError": exc_type.__name__, 
-                                                "runtimeErrorInfo": exc_value}).to_frame().T],
-                                  ignore_index=True)
+                errors.append({"fname": f, "domain":key, "runtimeError": exc_type.__name__, 
+                               "runtimeErrorInfo": exc_value})
                 print("ERROR LOG:", key, exc_type.__name__)
 
-        print(f, ":", df.shape)
-        print(f, "ERROR:", errdf.shape)
+        print(f, ":", len(rows))
+        print(f, "ERROR:", len(errors))
+
+    # build each frame once, concatenating row by row is quadratic
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    errdf = pd.DataFrame.from_records(errors, columns=ERROR_COLUMNS)
     return df, errdf   
 
 
-def mltproc_detection(flist, maxproc = psutil.cpu_count(logical = False), mute = False):
+def mltproc_detection(flist, maxproc = psutil.cpu_count(logical = False), mute = False, fields = None):
 
     pool = multiprocessing.Pool(processes = maxproc)
     
     fl_list = np.array_split(flist, maxproc)
     print("split...")
-    df_tuples = pool.map(process_data, fl_list)
+    df_tuples = pool.map(functools.partial(process_data, fields=fields), fl_list)
     
     resdf = [df_tuples[idx][0] for idx in range(len(df_tuples))]
     errdf = [df_tuples[idx][1] for idx in range(len(df_tuples))]
@@ -131,7 +152,11 @@ def mltproc_detection(flist, maxproc = psutil.cpu_count(logical = False), mute =
 @click.command()
 @click.option("--date", default=None, help="Specify Date to Parse. Default None. If None, parse current date.")
 @click.option("--dtype", default="apex", help="Specify Data Type to Parse. Default apex. Choose from [apex, www]. ")
-def cmd(date, dtype):
+@click.option("--format", "outformat", default=PARSED_FORMAT, type=click.Choice(["csv", "parquet", "both"]),
+              help="Output format of the parsed data. parquet writes typed nested columns to PARQUET_DIR.")
+@click.option("--fields", default=None, 
+              help="Comma separated columns to decode, from [https, ns, soa, a, aaaa], written to <dtype>_https.<fields>.csv. Default None decodes all.")
+def cmd(date, dtype, outformat, fields):
     """Parsing HTTPS DNS Records Data"""
 
     if date is None:
@@ -147,12 +172,18 @@ def cmd(date, dtype):
             
     if dtype not in ["apex", "www"]:
         raise ValueError('Choose from [apex, www]')
+
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(",")]
+        if any([field not in FIELD_QTYPES for field in fields]):
+            raise ValueError('Choose fields from [https, ns, soa, a, aaaa]')
+        if outformat != "csv":
+            raise ValueError('--fields writes a separate csv projection, use --format=csv')
     
     CPUCOUNT = psutil.cpu_count(logical = False)
     print("Total physical CPUs:", CPUCOUNT)
     
-    fl = glob.glob(f"/data/raw/{todaystr}/{dtype}/*.pickle")
-    fl.sort()
+    fl = list_raw_files(f"/data/raw/{todaystr}/{dtype}")
     print("Total length:", len(fl))
 
     if len(fl) == 0:
@@ -163,9 +194,15 @@ def cmd(date, dtype):
         os.mkdir(parsing_dir)
         print("Create folder:", parsing_dir)
 
-    datadf, errtotal = mltproc_detection(fl)
-    datadf.to_csv(os.path.join(parsing_dir, f"{dtype}_https.csv"), index=False)
-    errtotal.to_csv(os.path.join(parsing_dir, f"{dtype}_error.csv"), index=False)
+    # a projection goes next to the full parse, e.g. apex_https.a-ns.csv, never over it
+    suffix = "" if fields is None else "." + "-".join([field for field in FIELD_QTYPES if field in fields])
+
+    datadf, errtotal = mltproc_detection(fl, fields=fields)
+    if outformat in ["csv", "both"]:
+        datadf.to_csv(os.path.join(parsing_dir, f"{dtype}_https{suffix}.csv"), index=False)
+    if outformat in ["parquet", "both"]:
+        print("Parquet file:", write_parsed_parquet(datadf, todaystr, dtype))
+    errtotal.to_csv(os.path.join(parsing_dir, f"{dtype}_error{suffix}.csv"), index=False)
         
 
 if __name__ == "__main__":
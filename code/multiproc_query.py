@@ -11,18 +11,44 @@ import psutil
 import click
 # local import 
 from utils import Domain, CNameLoopsTooLong
-from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TRANCO_DIR, TLS_DIR
+from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TRANCO_DIR, TLS_DIR, SHARED_CACHE
+from dnscache import enable_shared_cache
 from asyncquery import *
+from rawstore import open_results, close_results, RAW_EXT
+from checkpoint import write_manifest, load_manifest, chunk_status, recover_record_file, summarize_progress
 
 from itertools import islice
 import multiprocessing
 
+# set by cmd, read by the pool workers
+RESUME = False
+
+
+def prepare_chunk(df: pd.DataFrame, columnname: str, outfpath: str):
+    """
+    domains of a chunk still to be queried and whether to append to the output file.
+    without resume every chunk is queried from scratch; with resume finished chunks
+    return None and partial raw record files are continued.
+    """
+    if not RESUME:
+        return init_domain_list(df, columnname), False
+
+    status = chunk_status(outfpath)
+    if status == "done":
+        print("SKIP FINISHED CHUNK:", outfpath)
+        return None
+    if status == "partial" and outfpath.endswith(".rec"):
+        finished = recover_record_file(outfpath)
+        print("RESUME CHUNK:", outfpath, ",FINISHED DOMAINS:", len(finished))
+        return init_domain_list(df[~df[columnname].isin(finished)], columnname), True
+    return init_domain_list(df, columnname), False
+
 
 def singlecore_querying(df_dict):
-    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}.pickle")
-    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}.pickle")
+    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}" + RAW_EXT)
+    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -30,14 +56,18 @@ def singlecore_querying(df_dict):
     print("Query APEX Domains")
 
     for key, df in df_dict.items():
-        dom_l = init_domain_list(df, "apex")
-        print(dom_l[0].name)
         outfpath = apex_file_fmt.format(key)
+        chunk = prepare_chunk(df, "apex", outfpath)
+        if chunk is None:
+            continue
+        dom_l, append = chunk
+        if len(dom_l) > 0:
+            print(dom_l[0].name)
         print("working on file:", key)
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath, append=append)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -50,22 +80,27 @@ def singlecore_querying(df_dict):
         print(f"{__file__} executed in {elapsed:0.6f} seconds.")
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+        get_answer_cache().flush()
+        print("DNS cache:", get_answer_cache().stats())
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
     
     # start query www domains
     print("\nQeury WWW Domains.......\n")
 
     for key, df in df_dict.items():
-        dom_l = init_domain_list(df, "www")
-        print(dom_l[0].name)
         outfpath = www_file_fmt.format(key)
+        chunk = prepare_chunk(df, "www", outfpath)
+        if chunk is None:
+            continue
+        dom_l, append = chunk
+        if len(dom_l) > 0:
+            print(dom_l[0].name)
         print("working on file:", key)
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath, append=append)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -78,9 +113,13 @@ def singlecore_querying(df_dict):
         print(f"{__file__} executed in {elapsed:0.6f} seconds.")
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+        get_answer_cache().flush()
+        print("DNS cache:", get_answer_cache().stats())
+
+        close_results(RESULTS, outfpath)
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+
+    close_socket_pools()
 
 
     loop.run_until_complete(loop.shutdown_asyncgens())
@@ -88,13 +127,19 @@ def singlecore_querying(df_dict):
     return 0
 
 
-def mltproc_querying(data, maxproc = psutil.cpu_count(logical = False), mute = False):
+# exit code of a --resume whose manifest does not match the run, see script/dailyquery.py
+MANIFEST_MISMATCH = 3
+
+
+def mltproc_querying(data, maxproc = psutil.cpu_count(logical = False), mute = False, maxsplit = None):
 
     pool = multiprocessing.Pool(processes = maxproc)
 
     # split into smaller df 
-    MAXSPLIT = 100 * maxproc
+    MAXSPLIT = 100 * maxproc if maxsplit is None else maxsplit
     df_list = np.array_split(data, MAXSPLIT)
+    if not RESUME:
+        write_manifest(OUT_DIR, MAXSPLIT, [len(df) for df in df_list])
 
     data_dict = {}
     proc_list = []
@@ -104,6 +149,9 @@ def mltproc_querying(data, maxproc = psutil.cpu_count(logical = False), mute = F
             proc_list.append(data_dict)
             data_dict = {}            
     
+    if len(data_dict) > 0:
+        proc_list.append(data_dict)
+
     res = pool.map(singlecore_querying, proc_list)
     print ("finished query")
     return 0 
@@ -112,9 +160,15 @@ def mltproc_querying(data, maxproc = psutil.cpu_count(logical = False), mute = F
 
 @click.command()
 @click.option("--date", default=None, help="Specify Date to Parse. Default None. If None, parse current date.")
-def cmd(date):
+@click.option("--shared-cache/--no-shared-cache", default=SHARED_CACHE, 
+              help="Share the DNS answer cache between all worker processes through a sqlite file under the output folder.")
+@click.option("--resume", is_flag=True, default=False, 
+              help="Continue an interrupted run of the same date: skip finished chunks and query only the rest.")
+def cmd(date, shared_cache, resume):
     ### Check Time
     global todaystr
+    global RESUME
+    RESUME = resume
     if date is None:
         today = datetime.datetime.now()
         todaystr = today.strftime("%Y-%m-%d")
@@ -147,8 +201,8 @@ def cmd(date):
     
     # split into smaller df 
     MAXSPLIT = 100 * CPUCOUNT
-    df_lst = np.array_split(tranco, MAXSPLIT)
 
+    global OUT_DIR
     OUT_DIR = os.path.join(DATAROOT_DIR, todaystr)
 
     if not os.path.exists(OUT_DIR):
@@ -173,8 +227,31 @@ def cmd(date):
     if not os.path.exists(WWW_DIR):
         os.mkdir(WWW_DIR)
         print("Create folder:", WWW_DIR)
+    if shared_cache:
+        cachefpath = os.path.join(OUT_DIR, "dnscache.sqlite")
+        enable_shared_cache(cachefpath)
+        print("Shared DNS cache:", cachefpath)
+
+    if resume:
+        manifest = load_manifest(OUT_DIR)
+        if manifest is None:
+            print("No manifest found in", OUT_DIR, ", start a new run.")
+            # must stay before mltproc_querying(): it writes a new manifest only when RESUME is False
+            RESUME = False
+        elif manifest["format"] != RAW_EXT or manifest["total"] != len(tranco):
+            print("Manifest does not match this run (format", manifest["format"], ", total", manifest["total"], ").")
+            # a click command's return value is not the exit code; resuming again cannot help,
+            # so dailyquery.py stops retrying on this code
+            sys.exit(MANIFEST_MISMATCH)
+        else:
+            # rebuild the chunks of the interrupted run
+            MAXSPLIT = manifest["maxsplit"]
+            progress = summarize_progress([os.path.join(APEX_DIR, "output_{:03d}" + RAW_EXT),
+                                           os.path.join(WWW_DIR, "output_{:03d}" + RAW_EXT)], range(MAXSPLIT))
+            print("Resume run of", manifest["created"], ",CHUNKS:", progress)
+
     print("Start query")
-    mltproc_querying(tranco)
+    mltproc_querying(tranco, maxsplit=MAXSPLIT)
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import ast
+import json
+import math
+import datetime
+import sqlite3
+
+import pandas as pd
+
+# local import
+from config import (NSIP_DB, NSIP_MIN_REFRESH_DAYS, NSIP_MAX_REFRESH_DAYS, NSIP_FULL_SWEEP_DAYS)
+from limiter import OVERLOAD_ERRORS
+
+"""
+incremental refresh of the nameserver A/AAAA sweep.
+
+nsrefresh keeps, per nameserver, the last observed addresses, their TTL and the change history:
+
+    nsrefresh (nameserver TEXT PRIMARY KEY, a TEXT, aaaa TEXT, ttl INTEGER, last_query TEXT,
+               last_change TEXT, change_count INTEGER, next_due TEXT)
+
+after an observation the nameserver is due again after the longer of its TTL and a stability
+interval: half the days since its addresses last changed, within [NSIP_MIN_REFRESH_DAYS,
+NSIP_MAX_REFRESH_DAYS]. a nameserver whose addresses just changed or whose query failed is due the
+next day. every NSIP_FULL_SWEEP_DAYS days all nameservers are queried. days are %Y-%m-%d strings.
+"""
+
+
+def ensure_refresh_tables(conn: sqlite3.Connection):
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS nsrefresh (nameserver TEXT PRIMARY KEY, a TEXT, aaaa TEXT,
+                        ttl INTEGER, last_query TEXT, last_change TEXT, change_count INTEGER, next_due TEXT)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS nsrefresh_next_due_idx ON nsrefresh (next_due)")
+        conn.execute("CREATE TABLE IF NOT EXISTS nsrefresh_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _day(logday: str) -> datetime.date:
+    return datetime.datetime.strptime(logday, "%Y-%m-%d").date()
+
+
+def _addresses(value, key: str) -> str:
+    """sorted, comma separated addresses of an IPAnswer JSON string, "" when there are none"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return ",".join(sorted(json.loads(value).get(key, [])))
+
+
+def _failed(error) -> bool:
+    if isinstance(error, str):
+        error = ast.literal_eval(error)
+    return any([err in OVERLOAD_ERRORS for err in error.values()])
+
+
+def refresh_interval(ttl: int, last_change: datetime.date, today: datetime.date) -> int:
+    """days until the next query of a nameserver observed today"""
+    stable_days = (today - last_change).days // 2
+    interval = min(NSIP_MAX_REFRESH_DAYS, max(NSIP_MIN_REFRESH_DAYS, stable_days))
+    if ttl is not None and ttl == ttl:
+        interval = max(interval, math.ceil(ttl / 86400))
+    return interval
+
+
+def plan_refresh(nshist: pd.DataFrame, logday: str, dbfpath: str = NSIP_DB,
+                 full_sweep_days: int = NSIP_FULL_SWEEP_DAYS) -> tuple:
+    """
+    nameservers of nshist to query on logday: the ones never observed and the ones due,
+    or all of them when the last full sweep is at least full_sweep_days old.
+    returns (nameservers, full_sweep); call mark_full_sweep() once a full sweep finished.
+    """
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    ensure_refresh_tables(conn)
+    row = conn.execute("SELECT value FROM nsrefresh_meta WHERE key='last_full_sweep'").fetchone()
+    if row is None or (_day(logday) - _day(row[0])).days >= full_sweep_days:
+        conn.close()
+        print("Full nameserver sweep:", len(nshist))
+        return nshist, True
+
+    notdue = pd.read_sql_query("SELECT nameserver FROM nsrefresh WHERE next_due > ?", conn, params=(logday,))
+    conn.close()
+    due = nshist.loc[~nshist["nameserver"].isin(notdue["nameserver"])]
+    print("Nameservers due:", len(due), "of", len(nshist), ",last full sweep:", row[0])
+    return due, False
+
+
+def mark_full_sweep(logday: str, dbfpath: str = NSIP_DB):
+    """record that every nameserver was queried on logday"""
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    ensure_refresh_tables(conn)
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO nsrefresh_meta VALUES ('last_full_sweep', ?)", (logday,))
+    conn.close()
+
+
+def record_observations(datadf: pd.DataFrame, logday: str, dbfpath: str = NSIP_DB) -> int:
+    """
+    update the refresh state with the parsed nameserver answers of logday (scpt_nsIP_parsing).
+    returns the number of nameservers whose addresses changed.
+    """
+    today = _day(logday)
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    ensure_refresh_tables(conn)
+    state = {row[0]: row[1:] for row in conn.execute("SELECT nameserver, a, aaaa, last_change, change_count FROM nsrefresh")}
+
+    rows = []
+    changed = 0
+    for name, a, aaaa, ttl, error in zip(datadf["nameserver"], datadf["a"], datadf["aaaa"], datadf["ttl"], datadf["error"]):
+        old = state.get(name)
+        if _failed(error): # no observation, keep the old answer and retry tomorrow
+            if old is None:
+                rows.append((name, None, None, None, logday, logday, 0, (today + datetime.timedelta(days=1)).isoformat()))
+            else:
+                rows.append((name, old[0], old[1], None, logday, old[2], old[3],
+                             (today + datetime.timedelta(days=1)).isoformat()))
+            continue
+
+        a, aaaa = _addresses(a, "A"), _addresses(aaaa, "AAAA")
+        if old is None:
+            last_change, change_count = logday, 0
+        elif (old[0], old[1]) != (a, aaaa):
+            last_change, change_count = logday, old[3] + 1
+            changed += 1
+        else:
+            last_change, change_count = old[2], old[3]
+        ttl = None if ttl is None or ttl != ttl else int(ttl)
+        next_due = today + datetime.timedelta(days=refresh_interval(ttl, _day(last_change), today))
+        rows.append((name, a, aaaa, ttl, logday, last_change, change_count, next_due.isoformat()))
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO nsrefresh VALUES (?,?,?,?,?,?,?,?)", rows)
+    conn.close()
+    print("Recorded nameserver observations:", len(rows), ",changed:", changed)
+    return changed
@@ -0,0 +1,177 @@
+import io
+import os
+import re
+import csv
+import sqlite3
+import datetime
+
+import click
+import pandas as pd
+
+# local import
+from config import PARSE_DIR, PARSED_INDEX_DB
+from dbschema import PRAGMAS
+
+"""
+per-domain index over the parsed daily csv files PARSE_DIR/<date>/<dtype>_https.csv.
+
+every row of a file is indexed by the byte range it occupies, so a lookup of one domain over
+a date range seeks to its rows instead of loading every daily file:
+
+    parsed_index (domain TEXT, dtype TEXT, day TEXT, offset INTEGER, length INTEGER,
+                  PRIMARY KEY (domain, dtype, day))
+    indexed_files (dtype TEXT, day TEXT, size INTEGER, mtime REAL, header TEXT,
+                   PRIMARY KEY (dtype, day))
+
+indexed_files records the size and mtime of each indexed file, so build_index() only reads
+the files that are new or were parsed again. days are %Y-%m-%d strings.
+"""
+
+DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def connect(dbfpath: str = PARSED_INDEX_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(dbfpath, timeout=60)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    with conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS parsed_index (domain TEXT, dtype TEXT, day TEXT,
+                        offset INTEGER, length INTEGER, PRIMARY KEY (domain, dtype, day)) WITHOUT ROWID""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS indexed_files (dtype TEXT, day TEXT, size INTEGER,
+                        mtime REAL, header TEXT, PRIMARY KEY (dtype, day))""")
+    return conn
+
+
+def csv_path(day: str, dtype: str, parsedir: str = PARSE_DIR) -> str:
+    return os.path.join(parsedir, day, f"{dtype}_https.csv")
+
+
+def scan_rows(fpath: str):
+    """
+    yield (domain, offset, length) for every data row of a parsed csv file, after the header.
+    a quoted field may hold a line break, so a row ends at the first line break outside quotes.
+    """
+    with open(fpath, "rb") as infile:
+        header = infile.readline()
+        domcol = next(csv.reader([header.decode()])).index("domain")
+        offset = len(header)
+        row = b""
+        for line in infile:
+            row += line
+            if row.count(b'"') % 2 == 1:
+                continue
+            fields = next(csv.reader([row.decode()]))
+            yield fields[domcol], offset, len(row)
+            offset += len(row)
+            row = b""
+
+
+def index_file(conn: sqlite3.Connection, day: str, dtype: str, parsedir: str = PARSE_DIR) -> int:
+    """(re)index one daily file, returns the number of rows"""
+    fpath = csv_path(day, dtype, parsedir)
+    with open(fpath, "rb") as infile:
+        header = infile.readline().decode().rstrip("\r\n")
+    stat = os.stat(fpath)
+    with conn:
+        conn.execute("DELETE FROM parsed_index WHERE dtype=? AND day=?", (dtype, day))
+        # a domain listed twice in a day keeps its last row
+        cur = conn.executemany("INSERT OR REPLACE INTO parsed_index VALUES (?,?,?,?,?)",
+                               ((domain, dtype, day, offset, length) for domain, offset, length in scan_rows(fpath)))
+        conn.execute("INSERT OR REPLACE INTO indexed_files VALUES (?,?,?,?,?)",
+                     (dtype, day, stat.st_size, stat.st_mtime, header))
+    return cur.rowcount
+
+
+def build_index(dtypes: list = ("apex", "www"), parsedir: str = PARSE_DIR, dbfpath: str = PARSED_INDEX_DB) -> int:
+    """index the daily files that are not indexed yet or changed since, returns the number of files indexed"""
+    conn = connect(dbfpath)
+    known = {(row[0], row[1]): (row[2], row[3]) for row in
+             conn.execute("SELECT dtype, day, size, mtime FROM indexed_files")}
+    count = 0
+    for day in sorted(os.listdir(parsedir)):
+        if not DAY_RE.match(day):
+            continue
+        for dtype in dtypes:
+            fpath = csv_path(day, dtype, parsedir)
+            if not os.path.exists(fpath):
+                continue
+            stat = os.stat(fpath)
+            if known.get((dtype, day)) == (stat.st_size, stat.st_mtime):
+                continue
+            print("Index:", fpath, index_file(conn, day, dtype, parsedir))
+            count += 1
+    conn.close()
+    return count
+
+
+def lookup(domain: str, start: str = None, end: str = None, dtype: str = "apex",
+           parsedir: str = PARSE_DIR, dbfpath: str = PARSED_INDEX_DB) -> pd.DataFrame:
+    """
+    parsed rows of one domain between start and end (inclusive), reading only their bytes.
+
+    Parameters
+    ----------
+    domain : domain as in the parsed files, e.g. example.com
+    start, end : %Y-%m-%d, None for an open range
+    dtype : apex or www
+
+    Returns
+    -------
+    pd.DataFrame with the csv columns and a day column, one row per indexed day
+    """
+    conn = connect(dbfpath)
+    rows = conn.execute("""SELECT p.day, p.offset, p.length, f.header FROM parsed_index p
+                           JOIN indexed_files f ON p.dtype = f.dtype AND p.day = f.day
+                           WHERE p.domain=? AND p.dtype=? AND p.day>=? AND p.day<=? ORDER BY p.day""",
+                        (domain, dtype, start or "", end or "9999-99-99")).fetchall()
+    conn.close()
+
+    frames = []
+    for day, offset, length, header in rows:
+        with open(csv_path(day, dtype, parsedir), "rb") as infile:
+            infile.seek(offset)
+            data = infile.read(length).decode()
+        # keep the columns as text, like the JSON strings of a full pd.read_csv would be
+        df = pd.read_csv(io.StringIO(header + "\n" + data), dtype={"version": str})
+        df.insert(0, "day", day)
+        frames.append(df)
+    if len(frames) == 0:
+        return pd.DataFrame(columns=["day"])
+    return pd.concat(frames, ignore_index=True)
+
+
+@click.group()
+def cli():
+    """Per-domain index over the parsed HTTPS data"""
+
+
+@cli.command()
+@click.option("--dtype", default=None, help="Index only this Data Type, [apex, www]. Default None indexes both.")
+def build(dtype):
+    """Index the parsed daily files that are new or changed"""
+    dtypes = ["apex", "www"] if dtype is None else [dtype]
+    print("Indexed files:", build_index(dtypes))
+
+
+@cli.command()
+@click.argument("domain")
+@click.option("--start", default=None, help="First date, %Y-%m-%d. Default None for the first indexed day.")
+@click.option("--end", default=None, help="Last date, %Y-%m-%d. Default None for the last indexed day.")
+@click.option("--dtype", default="apex", help="Specify Data Type. Default apex. Choose from [apex, www].")
+@click.option("--out", default=None, help="Write the rows to this csv file instead of printing them.")
+def find(domain, start, end, dtype, out):
+    """Parsed rows of DOMAIN between --start and --end"""
+    for dtime in [start, end]:
+        if dtime is not None:
+            datetime.datetime.strptime(dtime, "%Y-%m-%d")
+    df = lookup(domain, start, end, dtype)
+    if out is None:
+        with pd.option_context("display.max_colwidth", None, "display.width", None):
+            print(df)
+    else:
+        df.to_csv(out, index=False)
+        print("Rows:", len(df), "->", out)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,170 @@
+import os
+import ast
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError: # parquet output is optional, csv works without pyarrow
+    pa = None
+
+# local import
+from config import PARSE_DIR, PARQUET_DIR
+
+"""
+typed parquet copy of the parsed daily data, one file per day and data type:
+
+    PARQUET_DIR/date=<YYYY-MM-DD>/dtype=<apex|www>/part-0.parquet
+
+the JSON strings of the csv files become nested columns: ns, soa, a and aaaa are lists of strings,
+https is a list of HTTPS records with the SVCB parameters as a struct, https_rrsig holds the
+signatures of the HTTPS answer and error is a list of (qtype, error) pairs, empty for a clean domain.
+read_parsed() loads either format, preferring parquet.
+"""
+
+# SVCB parameters kept as struct fields, named as in dnsrecords.SVCBRecord.params_map,
+# keys without a field go to the "unknown" map as key<N> -> hex value
+SVCB_FIELDS = ["mandatory", "alph", "no-default-alph", "port", "ipv4hint", "ech", "ipv6hint",
+               "dohpath", "ohttp", "tls-supported-groups", "docpath"]
+# parameters without value, stored as true when present
+SVCB_FLAGS = ["no-default-alph", "ohttp"]
+
+RRSIG_FIELDS = ["algorithm", "expiration", "inception", "key_tag", "labels", "original_ttl", "rdclass",
+                "rdcomment", "rdtype", "signature", "signer", "type_covered"]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for parquet output, install it or use --format=csv")
+
+
+def _schema() -> "pa.Schema":
+    svcb = pa.struct([("mandatory", pa.list_(pa.int64())), ("alph", pa.string()), ("no-default-alph", pa.bool_()),
+                      ("port", pa.int64()), ("ipv4hint", pa.string()), ("ech", pa.string()), ("ipv6hint", pa.string()),
+                      ("dohpath", pa.string()), ("ohttp", pa.bool_()), ("tls-supported-groups", pa.list_(pa.int64())),
+                      ("docpath", pa.list_(pa.string())), ("unknown", pa.map_(pa.string(), pa.string()))])
+    https = pa.struct([("name", pa.string()), ("answer_ttl", pa.int64()), ("priority", pa.int64()),
+                       ("target", pa.string()), ("svcb", svcb)])
+    rrsig = pa.struct([("name", pa.string()), ("answer_ttl", pa.int64())] +
+                      [(field, pa.int64() if field in ["expiration", "inception", "key_tag", "labels", "original_ttl"]
+                        else pa.string()) for field in RRSIG_FIELDS])
+    error = pa.struct([("qtype", pa.string()), ("error", pa.string())])
+    return pa.schema([("version", pa.string()), ("rank", pa.int64()), ("domain", pa.string()), ("cname", pa.string()),
+                      ("https", pa.list_(https)), ("https_rrsig", pa.list_(rrsig)),
+                      ("ns", pa.list_(pa.string())), ("a", pa.list_(pa.string())), ("aaaa", pa.list_(pa.string())),
+                      ("error", pa.list_(error)), ("soa", pa.list_(pa.string()))])
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _json_list(value, key: str) -> list:
+    """list stored under key in a JSON string such as '{"NS": [...]}', None when missing"""
+    if _is_missing(value):
+        return None
+    return json.loads(value).get(key)
+
+
+def _https_list(value) -> tuple:
+    """HTTPS records and their signatures from the JSON string of dnsrecords.HTTPSAnswer"""
+    if _is_missing(value):
+        return None, None
+    parsed = json.loads(value)
+    records = []
+    for rec in parsed.get("HTTPS", []):
+        svcb = {field: rec.get("svcb." + field) for field in SVCB_FIELDS}
+        for field in SVCB_FLAGS:
+            svcb[field] = "svcb." + field in rec
+        svcb["unknown"] = [(key[len("svcb."):], value) for key, value in rec.items()
+                           if key.startswith("svcb.key")]
+        records.append({"name": rec.get("name"), "answer_ttl": rec.get("answer_ttl"), "priority": rec.get("priority"),
+                        "target": rec.get("target"), "svcb": svcb})
+    sigs = [{field: sig.get(field) for field in ["name", "answer_ttl"] + RRSIG_FIELDS} for sig in parsed.get("RRSIG", [])]
+    return records, sigs
+
+
+def _error_list(value) -> list:
+    """(qtype, error) pairs of the Domain.error dict, also accepted in its csv text form"""
+    if _is_missing(value):
+        return []
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+    return [{"qtype": qtype, "error": error} for qtype, error in value.items()]
+
+
+def to_arrow_table(df: pd.DataFrame) -> "pa.Table":
+    """convert a parsed HTTPS frame (multi_parsing.process_data) to the typed parquet table"""
+    _require_pyarrow()
+    https, rrsig = zip(*[_https_list(value) for value in df["https"]]) if len(df) > 0 else ((), ())
+    columns = {"version": [str(version) for version in df["version"]],
+               "rank": [None if _is_missing(rank) else int(rank) for rank in df["rank"]],
+               "domain": list(df["domain"]),
+               "cname": [None if _is_missing(cname) else cname for cname in df["cname"]],
+               "https": list(https),
+               "https_rrsig": list(rrsig),
+               "ns": [_json_list(value, "NS") for value in df["ns"]],
+               "a": [_json_list(value, "A") for value in df["a"]],
+               "aaaa": [_json_list(value, "AAAA") for value in df["aaaa"]],
+               "error": [_error_list(value) for value in df["error"]],
+               "soa": [_json_list(value, "SOA") for value in df["soa"]]}
+    return pa.Table.from_pydict(columns, schema=_schema())
+
+
+def parquet_path(logday: str, dtype: str, parquetdir: str = PARQUET_DIR) -> str:
+    return os.path.join(parquetdir, f"date={logday}", f"dtype={dtype}", "part-0.parquet")
+
+
+def write_parsed_parquet(df: pd.DataFrame, logday: str, dtype: str, parquetdir: str = PARQUET_DIR) -> str:
+    """write the parsed frame of a day to its parquet partition, replacing an earlier file"""
+    _require_pyarrow()
+    fpath = parquet_path(logday, dtype, parquetdir)
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    pq.write_table(to_arrow_table(df), fpath, compression="zstd", row_group_size=100000)
+    return fpath
+
+
+def read_parsed(logday: str, dtype: str, columns: list = None, status: str = None,
+                parsedir: str = PARSE_DIR, parquetdir: str = PARQUET_DIR) -> pd.DataFrame:
+    """
+    load the parsed HTTPS data of a day, from parquet when it was written, else from the csv file.
+
+    Parameters
+    ----------
+    logday : date of the data, %Y-%m-%d
+    dtype : apex or www
+    columns : columns to load, all when None
+    status : "ok" keeps domains without query errors, "failed" the ones with errors, None keeps all
+
+    Returns
+    -------
+    pd.DataFrame, nested columns are lists for parquet and JSON strings for csv
+    """
+    readcols = None
+    if columns is not None:
+        readcols = list(columns) + (["error"] if status is not None and "error" not in columns else [])
+
+    fpath = parquet_path(logday, dtype, parquetdir)
+    if os.path.exists(fpath):
+        _require_pyarrow()
+        table = pq.read_table(fpath, columns=readcols)
+        if status is not None:
+            clean = pc.equal(pc.list_value_length(table["error"]), 0)
+            table = table.filter(clean if status == "ok" else pc.invert(clean))
+        if columns is not None:
+            table = table.select(columns)
+        print("Loaded Data From:", fpath)
+        return table.to_pandas()
+
+    fpath = os.path.join(parsedir, logday, f"{dtype}_https.csv")
+    df = pd.read_csv(fpath, usecols=readcols)
+    if status is not None:
+        clean = df["error"] == "{}"
+        df = df.loc[clean if status == "ok" else ~clean]
+    if columns is not None:
+        df = df[columns]
+    print("Loaded Data From:", fpath)
+    return df
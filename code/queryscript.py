@@ -13,6 +13,7 @@ import psutil
 from utils import Domain, CNameLoopsTooLong
 from config import MAXCONCURRENCY, RESOLVER_LIST, DATAROOT_DIR, TRANCO_DIR
 from asyncquery import *
+from rawstore import open_results, close_results, RAW_EXT
 
 
 if __name__ == "__main__":
@@ -56,11 +57,11 @@ if __name__ == "__main__":
         print("Create folder:", www_dir)
 
 
-    apex_file_fmt = os.path.join(apex_dir, "output_{:03d}.pickle")
-    www_file_fmt = os.path.join(www_dir, "output_{:03d}.pickle")
+    apex_file_fmt = os.path.join(apex_dir, "output_{:03d}" + RAW_EXT)
+    www_file_fmt = os.path.join(www_dir, "output_{:03d}" + RAW_EXT)
 
     """ set up maximum concurrency """
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -76,7 +77,7 @@ if __name__ == "__main__":
         print("output file path:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -91,8 +92,7 @@ if __name__ == "__main__":
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
    
     
     # start query www domains
@@ -107,7 +107,7 @@ if __name__ == "__main__":
         print("working on file:", i)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -120,8 +120,10 @@ if __name__ == "__main__":
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+
+
+    close_socket_pools()
 
 
     loop.run_until_complete(loop.shutdown_asyncgens())
@@ -0,0 +1,250 @@
+import os
+import glob
+import pickle
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import dns
+import dns.message
+import dns.rdatatype
+
+# local import
+from utils import Domain
+from dnsrecords import LazyAnswer
+from config import RAW_FORMAT, STREAM_FLUSH_RECORDS, STREAM_FSYNC_SECONDS
+
+"""
+append-only raw record file, one record per (domain, query type):
+
+    uint32   length of the rest of the record
+    header   rank int32, qtype uint16, rcode uint16, timestamp float64, error code uint8,
+             name length uint16, cname length uint16, error name length uint16, wire length uint32
+    bytes    name, cname, error name (only for error code 255), DNS response wire format
+"""
+
+RECORD_LEN = struct.Struct("!I")
+RECORD_HEADER = struct.Struct("!iHHdBHHHI")
+
+NO_RCODE = 0xFFFF       # record holds an error, no response
+OTHER_ERROR = 255       # error not in ERROR_CODES, its name is stored in the record
+
+# error names stored in Domain.error, by code; 0 means no error
+ERROR_CODES = ["", "NoAnswer", "NXDOMAIN", "LifetimeTimeout", "Timeout", "NoNameservers",
+               "CNameLoopsTooLong", "YXDOMAIN", "NoRootSOA", "NoMetaqueries", "LabelTooLong", "EmptyLabel"]
+ERROR_IDS = {name: idx for idx, name in enumerate(ERROR_CODES)}
+
+RAW_EXT = {"wire": ".rec", "pickle": ".pickle"}[RAW_FORMAT]
+# completion marker written next to a finished raw record file
+DONE_EXT = ".done"
+
+RawRecord = namedtuple("RawRecord", ["rank", "name", "cname", "qtype", "rcode", "error", "timestamp", "wire"])
+
+
+def encode_record(rank: int, name: str, cname: str, qtype: str, rcode: int, error: str,
+                  timestamp: float, wire: bytes) -> bytes:
+    name_b = name.encode()
+    cname_b = cname.encode() if cname is not None else b""
+    error_id = ERROR_IDS.get(error, OTHER_ERROR) if error is not None else 0
+    error_b = error.encode() if error_id == OTHER_ERROR else b""
+    header = RECORD_HEADER.pack(int(rank), dns.rdatatype.from_text(qtype), rcode, timestamp, error_id,
+                                len(name_b), len(cname_b), len(error_b), len(wire))
+    body = b"".join([header, name_b, cname_b, error_b, wire])
+    return RECORD_LEN.pack(len(body)) + body
+
+
+def encode_domain(domain: Domain, timestamp: float = None) -> bytes:
+    """encode every stored message and error of the domain as raw records"""
+    if timestamp is None:
+        timestamp = time.time()
+    rank = domain.rank if domain.rank is not None else -1
+    records = []
+    for qtype, msg in domain.message.items():
+        records.append(encode_record(rank, domain.name, domain.cname, qtype, msg.rcode(),
+                                     domain.error.get(qtype), timestamp, msg.to_wire()))
+    for qtype, error in domain.error.items():
+        if qtype in domain.message:
+            continue
+        records.append(encode_record(rank, domain.name, domain.cname, qtype, NO_RCODE, error, timestamp, b""))
+    return b"".join(records)
+
+
+def decode_record(body: bytes) -> RawRecord:
+    (rank, qtype, rcode, timestamp, error_id,
+     name_len, cname_len, error_len, wire_len) = RECORD_HEADER.unpack_from(body)
+    offset = RECORD_HEADER.size
+    name = body[offset: offset + name_len].decode()
+    offset += name_len
+    cname = body[offset: offset + cname_len].decode() if cname_len > 0 else None
+    offset += cname_len
+    if error_id == OTHER_ERROR:
+        error = body[offset: offset + error_len].decode()
+    else:
+        error = ERROR_CODES[error_id] if error_id > 0 else None
+    offset += error_len
+    wire = body[offset: offset + wire_len]
+    return RawRecord(rank, name, cname, dns.rdatatype.to_text(qtype), rcode, error, timestamp, wire)
+
+
+def iter_records(fpath: str):
+    """
+    yield every record of a raw record file in order.
+    a truncated record at the end of the file (interrupted write) is ignored.
+    """
+    with open(fpath, "rb") as infile:
+        while True:
+            head = infile.read(RECORD_LEN.size)
+            if len(head) < RECORD_LEN.size:
+                return
+            (length,) = RECORD_LEN.unpack(head)
+            body = infile.read(length)
+            if len(body) < length:
+                return
+            yield decode_record(body)
+
+
+def load_records(fpath: str, qtypes: list = None) -> dict:
+    """
+    rebuild the Domain objects of a raw record file, keyed by domain name.
+    only responses of the given query types are kept, as LazyAnswer views that decode on use;
+    errors are always restored.
+    """
+    domain_dict = {}
+    for rec in iter_records(fpath):
+        domain = domain_dict.get(rec.name)
+        if domain is None:
+            domain = Domain(rec.name, rec.rank)
+            domain.cname = rec.cname
+            domain_dict[rec.name] = domain
+        if rec.error is not None:
+            domain.error[rec.qtype] = rec.error
+        if rec.rcode != NO_RCODE and (qtypes is None or rec.qtype in qtypes):
+            domain.message[rec.qtype] = LazyAnswer(rec.wire)
+    return domain_dict
+
+
+def write_records(data_dict: dict, fpath: str):
+    with open(fpath, "wb") as outfile:
+        for domain in data_dict.values():
+            outfile.write(encode_domain(domain))
+
+
+class StreamingWriter:
+    """
+    drop-in replacement for the RESULTS dict of a chunk that streams every finished Domain
+    to a raw record file instead of keeping it in memory.
+    encoded records are buffered and handed to a background thread that appends them to the
+    file and fsyncs periodically; close() flushes everything and writes the chunk completion marker.
+    with append, records are added to an existing (partial) file instead of replacing it.
+    """
+    def __init__(self, fpath: str, append: bool = False, flush_records: int = STREAM_FLUSH_RECORDS,
+                 fsync_seconds: float = STREAM_FSYNC_SECONDS):
+        self.fpath = fpath
+        self.flush_records = flush_records
+        self.fsync_seconds = fsync_seconds
+        self.buffer = []
+        self.count = 0
+        self.last_flush = time.monotonic()
+        self.queue = queue.Queue()
+        # the file is being written again, a marker left by an earlier run no longer holds
+        if os.path.exists(fpath + DONE_EXT):
+            os.remove(fpath + DONE_EXT)
+        self.outfile = open(fpath, "ab" if append else "wb")
+        self.thread = threading.Thread(target=self.__write_loop__, daemon=True)
+        self.thread.start()
+
+    def __write_loop__(self):
+        last_sync = time.monotonic()
+        while True:
+            data = self.queue.get()
+            if data is None: # closing
+                break
+            self.outfile.write(data)
+            if time.monotonic() - last_sync >= self.fsync_seconds:
+                self.outfile.flush()
+                os.fsync(self.outfile.fileno())
+                last_sync = time.monotonic()
+        self.outfile.flush()
+        os.fsync(self.outfile.fileno())
+        self.outfile.close()
+
+    def __setitem__(self, name: str, domain: Domain):
+        self.buffer.append(encode_domain(domain))
+        self.count += 1
+        if len(self.buffer) >= self.flush_records or time.monotonic() - self.last_flush >= self.fsync_seconds:
+            self.flush()
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.queue.put(b"".join(self.buffer))
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self, complete: bool = True):
+        """flush and close the file; with complete, mark the chunk as done"""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if complete:
+            with open(self.fpath + DONE_EXT, "w") as outfile:
+                outfile.write(str(self.count))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+
+
+def chunk_done(fpath: str) -> bool:
+    """true if the chunk result file was completely written"""
+    if fpath.endswith(".rec"):
+        return os.path.exists(fpath + DONE_EXT)
+    return os.path.exists(fpath)
+
+
+def open_results(fpath: str, append: bool = False):
+    """
+    RESULTS container for a chunk: a StreamingWriter for raw record files, a dict for pickles.
+    with append, a raw record file left by an interrupted run is continued.
+    """
+    if fpath.endswith(".rec"):
+        return StreamingWriter(fpath, append=append)
+    return dict()
+
+
+def close_results(results, fpath: str):
+    """finish a chunk opened with open_results"""
+    if isinstance(results, StreamingWriter):
+        results.close()
+    else:
+        dump_results(results, fpath)
+
+
+def dump_results(data_dict: dict, fpath: str):
+    """save the query results of a chunk, in the format given by the file extension"""
+    if fpath.endswith(".rec"):
+        write_records(data_dict, fpath)
+    else:
+        with open(fpath, 'wb') as outfile:
+            pickle.dump(data_dict, outfile)
+
+
+def load_results(fpath: str, qtypes: list = None) -> dict:
+    """load the query results of a chunk saved by dump_results, as a dict of Domain"""
+    if fpath.endswith(".rec"):
+        return load_records(fpath, qtypes)
+    with open(fpath, 'rb') as infile:
+        return pickle.load(infile)
+
+
+def list_raw_files(dirpath: str) -> list:
+    """sorted list of raw result files (pickle or raw record) in the folder, completion markers excluded"""
+    fl = glob.glob(os.path.join(dirpath, "*.pickle")) + glob.glob(os.path.join(dirpath, "*.rec"))
+    fl.sort()
+    return fl
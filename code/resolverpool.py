@@ -0,0 +1,138 @@
+import asyncio
+import collections
+import os
+import time
+
+import dns
+import dns.exception
+import dns.rdataclass
+import dns.resolver
+
+# local import
+from config import RESOLVER_QPS, RESOLVER_DEFAULT_QPS, RESOLVER_EJECT_RATE, RESOLVER_EJECT_SECONDS
+
+# errors that say something about the upstream, not about the queried domain
+UPSTREAM_ERRORS = (dns.exception.Timeout, dns.resolver.NoNameservers)
+
+
+class TokenBucket:
+    """
+    token bucket that allows `rate` acquisitions per second on average
+    with bursts of up to `burst`
+    """
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def available(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    async def acquire(self):
+        while self.available() < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+        self.tokens -= 1
+
+
+class UpstreamState:
+    """
+    query budget and health of one upstream resolver.
+    an upstream whose recent failure rate exceeds `eject_rate` is ejected for
+    `eject_seconds`, then comes back with a clean history.
+    """
+    def __init__(self, address: str, qps: float, eject_rate: float = RESOLVER_EJECT_RATE,
+                 eject_seconds: float = RESOLVER_EJECT_SECONDS, window: int = 100):
+        self.address = address
+        self.bucket = TokenBucket(qps)
+        self.eject_rate = eject_rate
+        self.eject_seconds = eject_seconds
+        self.recent = collections.deque(maxlen=window)
+        self.inflight = 0
+        self.ejected_until = 0.0
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def record(self, failed: bool):
+        self.recent.append(failed)
+        if len(self.recent) < self.recent.maxlen:
+            return
+        if sum(self.recent) / len(self.recent) > self.eject_rate:
+            self.ejected_until = time.monotonic() + self.eject_seconds
+            self.recent.clear()
+            print("EJECT RESOLVER:", self.address, "for", self.eject_seconds, "seconds")
+
+
+# upstream budgets and health are shared by every pool of the process
+_UPSTREAMS = {}
+
+
+def get_upstream_state(address: str) -> UpstreamState:
+    state = _UPSTREAMS.get(address)
+    if state is None:
+        state = UpstreamState(address, RESOLVER_QPS.get(address, RESOLVER_DEFAULT_QPS))
+        _UPSTREAMS[address] = state
+    return state
+
+
+class ResolverPool:
+    """
+    spread queries over several single-upstream resolvers.
+    each query goes to the healthy upstream with budget left and the fewest queries
+    in flight (round-robin between equals), waits for that upstream's token bucket,
+    and moves on to the next upstream on timeouts or SERVFAIL/REFUSED. resolve() follows dns.asyncresolver.Resolver.resolve.
+
+    Parameters
+    ----------
+    resolvers : dict, upstream address -> resolver querying only that upstream
+    """
+    def __init__(self, resolvers: dict):
+        self.resolvers = resolvers
+        self.upstreams = [get_upstream_state(address) for address in resolvers.keys()]
+        # round-robin position, every worker process starts on a different upstream
+        self.turn = os.getpid() % len(self.upstreams)
+
+    def pick(self, tried: set) -> UpstreamState:
+        candidates = [up for up in self.upstreams if up.address not in tried]
+        healthy = [up for up in candidates if up.healthy()]
+        if len(healthy) == 0: # everyone is ejected, fall back to the one that returns first
+            return min(candidates, key=lambda up: up.ejected_until)
+
+        # upstreams with a token first, then the least in flight, ties go round-robin
+        n = len(self.upstreams)
+        order = {up.address: (idx - self.turn) % n for idx, up in enumerate(self.upstreams)}
+        upstream = max(healthy, key=lambda up: (up.bucket.available() >= 1, -up.inflight, -order[up.address]))
+        self.turn = (self.upstreams.index(upstream) + 1) % n
+        return upstream
+
+    async def resolve(self, qname, rdtype="A", rdclass=dns.rdataclass.IN,
+                      raise_on_no_answer: bool = True) -> dns.resolver.Answer:
+        tried = set()
+        last_err = None
+        while len(tried) < len(self.upstreams):
+            upstream = self.pick(tried)
+            tried.add(upstream.address)
+            await upstream.bucket.acquire()
+
+            upstream.inflight += 1
+            try:
+                answer = await self.resolvers[upstream.address].resolve(qname, rdtype, rdclass=rdclass,
+                                                                        raise_on_no_answer=raise_on_no_answer)
+            except UPSTREAM_ERRORS as err:
+                upstream.record(True)
+                last_err = err
+                continue
+            except Exception as err: # NXDOMAIN, NoAnswer, ... are valid answers
+                upstream.record(False)
+                raise err
+            finally:
+                upstream.inflight -= 1
+
+            upstream.record(False)
+            return answer
+
+        raise last_err
@@ -15,9 +15,16 @@ import multiprocessing
 import numpy as np
 
 from dnsrecords import *
+from rawstore import load_results, list_raw_files
 
+# only these responses are decoded from raw record files
+QTYPES = ["NS", "SOA"]
+# output columns, in the order of the csv files
+COLUMNS = ["version", "rank", "domain", "ns", "soa", "error"]
+ERROR_COLUMNS = ["fname", "domain", "runtimeErrorType", "runtimeErrorInfo", "runtimeError"]
 
-def unpack_domain_obj(domain:Domain) -> pd.Series:
+
+def unpack_domain_obj(domain:Domain) -> dict:
     version = "errdom-0.1"
     rank = domain.rank
     name = domain.name
@@ -45,20 +52,19 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
             raise err
             
     
-    res = pd.Series({"version": version, "rank": rank, "domain": name, 
-           "ns": NS, "soa": SOA, "error": error})
+    res = {"version": version, "rank": rank, "domain": name, 
+           "ns": NS, "soa": SOA, "error": error}
     
     return res
 
 
 def process_data(flist: list) -> pd.DataFrame:
-    df = pd.DataFrame(columns = ["version", "rank", "domain", "ns", "soa", "error"])
-    errdf = pd.DataFrame(columns = ["fname", "domain", "runtimeErrorType", "runtimeErrorInfo"])
+    rows = []
+    errors = []
 
     for f in flist:
         print(f)
-        with open (f, 'rb') as infile:
-            domain_dict = pickle.load(infile)
+        domain_dict = load_results(f, qtypes=QTYPES)
 
         for key, value in domain_dict.items():
             try:
@@ -68,16 +74,18 @@ def process_data(flist: list) -> pd.DataFrame:
                     print(f, key, "EMPTY")
                     continue
                 
-                df = pd.concat([df, res.to_frame().T], ignore_index=True)
-                #df = df.append(res, ignore_index=True)
+                rows.append(res)
             except Exception as err:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
-                errdf = pd.concat([errdf, pd.Series({"fname": f, "domain":key, "runtimeError": exc_type.__name__, "runtimeErrorInfo": exc_value}).to_frame().T],
-                                  ignore_index=True)
+                errors.append({"fname": f, "domain":key, "runtimeError": exc_type.__name__, "runtimeErrorInfo": exc_value})
                 print("ERROR LOG:", key, exc_type.__name__)
 
-        print(f, ":", df.shape)
-        print(f, "ERROR:", errdf.shape)
+        print(f, ":", len(rows))
+        print(f, "ERROR:", len(errors))
+
+    # build each frame once, concatenating row by row is quadratic
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    errdf = pd.DataFrame.from_records(errors, columns=ERROR_COLUMNS)
     return df, errdf   
 
 
@@ -124,8 +132,7 @@ def cmd(dtime, dtype):
     CPUCOUNT = psutil.cpu_count(logical = False)
     print("Total physical CPUs:", CPUCOUNT)
     
-    fl = glob.glob(f"/data/errordom/raw/{todaystr}/{dtype}/*.pickle")
-    fl.sort()
+    fl = list_raw_files(f"/data/errordom/raw/{todaystr}/{dtype}")
     print("Total length:", len(fl))
 
     if len(fl) == 0:
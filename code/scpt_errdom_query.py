@@ -14,6 +14,8 @@ import sqlite3
 from utils import Domain, CNameLoopsTooLong
 from config import MAXCONCURRENCY, RESOLVER_LIST, PARSE_DIR, ERRDF_DIR
 from asyncquery import *
+from rawstore import open_results, close_results, RAW_EXT
+from parsedstore import read_parsed
 
 from itertools import islice
 import multiprocessing
@@ -39,9 +41,9 @@ def singlecore_apexquerying(df_dict):
         os.mkdir(APEX_DIR)
         print("Create folder:", APEX_DIR)
 
-    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}.pickle")
+    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -57,7 +59,7 @@ def singlecore_apexquerying(df_dict):
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -70,8 +72,9 @@ def singlecore_apexquerying(df_dict):
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+    
+    close_socket_pools()
     
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
@@ -98,9 +101,9 @@ def singlecore_wwwquerying(df_dict):
         os.mkdir(WWW_DIR)
         print("Create folder:", WWW_DIR)
 
-    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}.pickle")
+    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -116,7 +119,7 @@ def singlecore_wwwquerying(df_dict):
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -129,8 +132,9 @@ def singlecore_wwwquerying(df_dict):
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+    
+    close_socket_pools()
     
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
@@ -184,12 +188,9 @@ if __name__ == "__main__":
     print("Datetime:", todaystr)
     
     ### Update History Database
-    apexdf = pd.read_csv(os.path.join(PARSE_DIR, todaystr, "apex_https.csv"))
-    wwwdf = pd.read_csv(os.path.join(PARSE_DIR, todaystr, "www_https.csv"))
-
-    apexdf_err = apexdf.loc[apexdf["error"]!="{}"][["domain", "rank"]]
+    apexdf_err = read_parsed(todaystr, "apex", columns=["domain", "rank"], status="failed")
     apexdf_err = apexdf_err.rename(columns={"domain":"apex"})
-    wwwdf_err = wwwdf.loc[wwwdf["error"]!="{}"][["domain", "rank"]]
+    wwwdf_err = read_parsed(todaystr, "www", columns=["domain", "rank"], status="failed")
     wwwdf_err = wwwdf_err.rename(columns={"domain":"www"})
 
     print("Apex Error DF:", apexdf_err.shape)
@@ -15,9 +15,20 @@ import multiprocessing
 import numpy as np
 
 from dnsrecords import *
+from rawstore import load_results, list_raw_files
+from histdelta import record_snapshot
+from checkpoint import unfinished_chunks
+from config import HIST_DIR, HIST_PARSED, HIST_STORE
+import shutil
 
+# only these responses are decoded from raw record files
+QTYPES = ["NS", "SOA"]
+# output columns, in the order of the csv files
+COLUMNS = ["version", "rank", "domain", "ns", "soa", "error"]
+ERROR_COLUMNS = ["domain", "runtimeErrorType", "runtimeErrorInfo", "fname", "runtimeError"]
 
-def unpack_domain_obj(domain:Domain) -> pd.Series:
+
+def unpack_domain_obj(domain:Domain) -> dict:
     version = "history-0.1"
     rank = domain.rank
     name = domain.name
@@ -49,20 +60,19 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
             raise err
             
     
-    res = pd.Series({"version": version, "rank": rank, "domain": name, 
-           "ns": NS, "soa": SOA, "error": error})
+    res = {"version": version, "rank": rank, "domain": name, 
+           "ns": NS, "soa": SOA, "error": error}
     
     return res
 
 
 def process_data(flist: list) -> pd.DataFrame:
-    df = pd.DataFrame(columns = ["version", "rank", "domain", "ns", "soa", "error"])
-    errdf = pd.DataFrame(columns = ["domain", "runtimeErrorType", "runtimeErrorInfo"])
+    rows = []
+    errors = []
 
     for f in flist:
         print(f)
-        with open (f, 'rb') as infile:
-            domain_dict = pickle.load(infile)
+        domain_dict = load_results(f, qtypes=QTYPES)
 
         for key, value in domain_dict.items():
             try:
@@ -72,17 +82,19 @@ def process_data(flist: list) -> pd.DataFrame:
                     print(f, key, "EMPTY")
                     continue
                 
-                df = pd.concat([df, res.to_frame().T], ignore_index=True)
-                #df = df.append(res, ignore_index=True)
+                rows.append(res)
             except Exception as err:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
-                errdf = pd.concat([errdf, pd.Series({"fname": f, "domain":key, "runtimeError": exc_type.__name__, 
-                                                "runtimeErrorInfo": exc_value}).to_frame().T],
-                                  ignore_index=True)
+                errors.append({"fname": f, "domain":key, "runtimeError": exc_type.__name__, 
+                               "runtimeErrorInfo": exc_value})
                 print("ERROR LOG:", key, exc_type.__name__)
 
-        print(f, ":", df.shape)
-        print(f, "ERROR:", errdf.shape)
+        print(f, ":", len(rows))
+        print(f, "ERROR:", len(errors))
+
+    # build each frame once, concatenating row by row is quadratic
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    errdf = pd.DataFrame.from_records(errors, columns=ERROR_COLUMNS)
     return df, errdf   
 
 
@@ -105,7 +117,11 @@ def mltproc_detection(flist, maxproc = psutil.cpu_count(logical = False), mute =
 @click.command()
 @click.option("--dtime", default=None, help="Specify Date to Parse. Default None. If None, parse current date.")
 @click.option("--dtype", default="apex", help="Specify Data Type to Parse. Default apex. Choose from [apex, www]. ")
-def cmd(dtime, dtype):
+@click.option("--store", default=HIST_STORE, type=click.Choice(["csv", "delta", "both"]),
+              help="Write the full csv snapshot, the changes into the delta store (histdelta.py), or both.")
+@click.option("--prune-raw", is_flag=True, default=False,
+              help="Remove the raw query files of the day once they are recorded in the delta store.")
+def cmd(dtime, dtype, store, prune_raw):
     """Query HTTPS DNS Records Data every Hour"""
 
     if dtime is None:
@@ -129,21 +145,37 @@ def cmd(dtime, dtype):
     CPUCOUNT = psutil.cpu_count(logical = False)
     print("Total physical CPUs:", CPUCOUNT)
     
-    fl = glob.glob(f"/data/history/raw/{todaystr}/{dtype}/*.pickle")
-    fl.sort()
+    raw_dir = os.path.join(HIST_DIR, todaystr, dtype)
+    fl = list_raw_files(raw_dir)
     print("Total length:", len(fl))
 
     if len(fl) == 0:
         print("NO Files")
+        return
 
-    parsing_dir = os.path.join("/data/history/parsed", todaystr) 
+    parsing_dir = os.path.join(HIST_PARSED, todaystr) 
     if not os.path.exists(parsing_dir):
         os.mkdir(parsing_dir)
         print("Create folder:", parsing_dir)
 
+    # chunks of an interrupted query run are partial or missing, the day does not list every domain
+    unfinished = unfinished_chunks(raw_dir)
+    if len(unfinished) > 0:
+        print("WARNING: unfinished query chunks:", len(unfinished), unfinished[:5])
+
     datadf, errtotal = mltproc_detection(fl)
-    datadf.to_csv(os.path.join(parsing_dir, f"{dtype}_https.csv"), index=False)
     errtotal.to_csv(os.path.join(parsing_dir, f"{dtype}_error.csv"), index=False)
+    if store in ["csv", "both"]:
+        datadf.to_csv(os.path.join(parsing_dir, f"{dtype}_https.csv"), index=False)
+    if store in ["delta", "both"]:
+        record_snapshot(datadf, todaystr[:10], dtype, skipped=errtotal["domain"], complete=len(unfinished) == 0)
+        # the raw files can only be parsed again while they exist, keep them if any failed to parse
+        # or the query run did not finish
+        if prune_raw and len(errtotal) == 0 and len(unfinished) == 0:
+            shutil.rmtree(raw_dir)
+            print("Removed raw files:", raw_dir)
+        elif prune_raw:
+            print("WARNING: raw files kept,", len(unfinished), "unfinished chunks,", len(errtotal), "parse errors:", raw_dir)
         
 
 if __name__ == "__main__":
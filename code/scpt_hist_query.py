@@ -12,8 +12,12 @@ import sqlite3
 
 # local import 
 from utils import Domain, CNameLoopsTooLong
-from config import MAXCONCURRENCY, RESOLVER_LIST, HIST_DIR, HIST_DB, PARSE_DIR
+from config import MAXCONCURRENCY, RESOLVER_LIST, HIST_DIR, HIST_DB, PARSE_DIR, HIST_ACTIVE_DAYS
 from asyncquery import *
+from rawstore import open_results, close_results, RAW_EXT
+from checkpoint import write_manifest
+from parsedstore import read_parsed
+from dbschema import connect, read_table, upsert_seen, HIST_TABLES
 
 from itertools import islice
 import multiprocessing
@@ -39,9 +43,9 @@ def singlecore_apexquerying(df_dict):
         os.mkdir(APEX_DIR)
         print("Create folder:", APEX_DIR)
 
-    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}.pickle")
+    apex_file_fmt = os.path.join(APEX_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -57,7 +61,7 @@ def singlecore_apexquerying(df_dict):
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -70,8 +74,9 @@ def singlecore_apexquerying(df_dict):
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+    
+    close_socket_pools()
     
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
@@ -96,9 +101,9 @@ def singlecore_wwwquerying(df_dict):
         os.mkdir(WWW_DIR)
         print("Create folder:", WWW_DIR)
 
-    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}.pickle")
+    www_file_fmt = os.path.join(WWW_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -114,7 +119,7 @@ def singlecore_wwwquerying(df_dict):
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
 
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
@@ -127,8 +132,9 @@ def singlecore_wwwquerying(df_dict):
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+    
+    close_socket_pools()
     
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
@@ -143,6 +149,13 @@ def mltproc_histquerying(apexhist, wwwhist, maxproc = psutil.cpu_count(logical =
     MOD = 20
     MAXSPLIT = MOD * maxproc
     
+    # the manifests let scpt_hist_parsing tell a complete day from an interrupted one
+    todaystr = datetime.datetime.now().strftime("%Y-%m-%d")
+    for dtype, hist in [("apex", apexhist), ("www", wwwhist)]:
+        outdir = os.path.join(HIST_DIR, todaystr, dtype)
+        os.makedirs(outdir, exist_ok=True)
+        write_manifest(outdir, MAXSPLIT, [len(df) for df in np.array_split(hist, MAXSPLIT)])
+
     # query apex
     df_list = np.array_split(apexhist, MAXSPLIT)
 
@@ -170,81 +183,38 @@ def mltproc_histquerying(apexhist, wwwhist, maxproc = psutil.cpu_count(logical =
     print ("finished query")
     return 0 
 
-def upsert_entry(dom, logday, dbcursor, dtype="apex",):
-    
-    if dtype == "apex":    
-        dbcursor.execute("""SELECT EXISTS(SELECT 1 FROM apexhistory WHERE apex=?);""", (dom,))
-        hasrecord = dbcursor.fetchone()[0]
-    
-        if hasrecord == 0:  # insert new entry
-            dbcursor.execute("""INSERT INTO apexhistory VALUES (?,?,?)""", (dom, logday, logday))
-        elif hasrecord == 1:
-            #print("hasrecord")
-            dbcursor.execute("""UPDATE apexhistory SET last_seen=? WHERE apex=?""", (logday, dom))
-        else:
-            print("HAS RECORD ERROR...")
-            return -1
-        return 0
-
-    if dtype == "www":    
-        dbcursor.execute("""SELECT EXISTS(SELECT 1 FROM wwwhistory WHERE www=?);""", (dom,))
-        hasrecord = dbcursor.fetchone()[0]
-    
-        if hasrecord == 0:  # insert new entry
-            dbcursor.execute("""INSERT INTO wwwhistory VALUES (?,?,?)""", (dom, logday, logday))
-        elif hasrecord == 1:
-            #print("hasrecord")
-            dbcursor.execute("""UPDATE wwwhistory SET last_seen=? WHERE www=?""", (logday, dom))
-        else:
-            print("HAS RECORD ERROR...")
-            return -1
-        return 0
+# dtype -> (history table, domain column)
+DTYPE_TABLES = {"apex": ("apexhistory", "apex"), "www": ("wwwhistory", "www")}
+
+
+def upsert_entries(domains, logday, conn, dtype="apex"):
+    ## add the domains seen on logday to the history table of dtype, or move their last_seen to logday
+    table, column = DTYPE_TABLES[dtype]
+    cnt = upsert_seen(conn, table, domains, logday)
+    print("Upserted", cnt, "rows into", table)
+    return 0
 
     
 def update_database(logday, dbfpath=HIST_DB):
     ## Update history database using latest data
     ## Connecting to database
-    conn = sqlite3.connect(dbfpath)
-    dbcursor = conn.cursor()
+    conn = connect(dbfpath, HIST_TABLES)
     
     ## loading parsed data
-    apexfpath = os.path.join(PARSE_DIR, logday, "apex_https.csv")
-    apexdf = pd.read_csv(apexfpath)
-    apexdf = apexdf.loc[apexdf["error"]=="{}"]
-    print("Loaded Data From:", apexfpath)
-
-    cnt = 0
-    for idx, item in apexdf.iterrows():
-        if cnt % 1000 == 0:
-            print(idx, item["domain"], logday)
-        upsert_entry(item["domain"], logday, dbcursor, dtype="apex")
-        cnt += 1
-    
-    wwwfpath = os.path.join(PARSE_DIR, logday, "www_https.csv")
-    wwwdf = pd.read_csv(wwwfpath)
-    wwwdf = wwwdf.loc[wwwdf["error"]=="{}"]
-    print("Loaded Data From:", wwwfpath)
+    apexdf = read_parsed(logday, "apex", columns=["domain"], status="ok")
+    upsert_entries(apexdf["domain"], logday, conn, dtype="apex")
     
-    cnt = 0
-    for idx, item in wwwdf.iterrows():
-        if cnt % 1000 == 0:
-            print(idx, item["domain"], logday)
-        upsert_entry(item["domain"], logday, dbcursor, dtype="www")
-        cnt += 1
+    wwwdf = read_parsed(logday, "www", columns=["domain"], status="ok")
+    upsert_entries(wwwdf["domain"], logday, conn, dtype="www")
 
     conn.commit()
     conn.close()
     return 0
 
-def get_hist_table(dtype, dbfpath=HIST_DB):
-    conn = sqlite3.connect(dbfpath)
-    if dtype == "apex":
-        resdf = pd.read_sql_query("SELECT * from apexhistory", conn)
-    
-    if dtype == "www":
-        resdf = pd.read_sql_query("SELECT * from wwwhistory", conn)
-
-    conn.commit()
+def get_hist_table(dtype, dbfpath=HIST_DB, active_days=None):
+    ## history table of dtype, only the domains seen in the last active_days days if given
+    conn = connect(dbfpath, HIST_TABLES)
+    resdf = read_table(conn, DTYPE_TABLES[dtype][0], active_days)
     conn.close()
     return resdf
 
@@ -260,11 +230,11 @@ if __name__ == "__main__":
     
     ### Update History Database
     update_database(todaystr)
-    wwwhist = get_hist_table("www")
+    wwwhist = get_hist_table("www", active_days=HIST_ACTIVE_DAYS)
     wwwhist["rank"] = -1
     print("www history table shape:", wwwhist.shape)
     print(wwwhist.head(1))
-    apexhist = get_hist_table("apex")
+    apexhist = get_hist_table("apex", active_days=HIST_ACTIVE_DAYS)
     apexhist["rank"] = -1
     print("apex history table shape:", apexhist.shape)
     print(apexhist.head(1))
@@ -15,9 +15,18 @@ import multiprocessing
 import numpy as np
 
 from dnsrecords import *
+from rawstore import load_results, list_raw_files
+from nsrefresh import record_observations
+from config import NSIP_INCREMENTAL
 
+# only these responses are decoded from raw record files
+QTYPES = ["A", "AAAA"]
+# output columns, in the order of the csv files
+COLUMNS = ["version", "nameserver", "a", "aaaa", "error", "ttl"]
+ERROR_COLUMNS = ["fname", "nameserver", "runtimeErrorType", "runtimeErrorInfo", "runtimeError"]
 
-def unpack_domain_obj(domain:Domain) -> pd.Series:
+
+def unpack_domain_obj(domain:Domain) -> dict:
     version = "ns-0.1"
     name = domain.name
     error = domain.error
@@ -44,20 +53,24 @@ def unpack_domain_obj(domain:Domain) -> pd.Series:
             raise err
             
     
-    res = pd.Series({"version": version, "nameserver": name, 
-           "a": A, "aaaa": AAAA, "error": error})
+    # smallest TTL of the address answers, drives the refresh planner (nsrefresh.py)
+    ttls = [rr.ttl for qtype in QTYPES if qtype in domain.message.keys()
+            for rr in domain.message[qtype].answer if rr.rdtype in [1, 28]]
+    TTL = min(ttls) if len(ttls) > 0 else None
+    
+    res = {"version": version, "nameserver": name, 
+           "a": A, "aaaa": AAAA, "error": error, "ttl": TTL}
     
     return res
 
 
 def process_data(flist: list) -> pd.DataFrame:
-    df = pd.DataFrame(columns = ["version", "nameserver", "a", "aaaa", "error"])
-    errdf = pd.DataFrame(columns = ["fname", "nameserver", "runtimeErrorType", "runtimeErrorInfo"])
+    rows = []
+    errors = []
 
     for f in flist:
         print(f)
-        with open (f, 'rb') as infile:
-            domain_dict = pickle.load(infile)
+        domain_dict = load_results(f, qtypes=QTYPES)
 
         for key, value in domain_dict.items():
             try:
@@ -67,16 +80,18 @@ def process_data(flist: list) -> pd.DataFrame:
                     print(f, key, "EMPTY")
                     continue
                 
-                df = pd.concat([df, res.to_frame().T], ignore_index=True)
-                #df = df.append(res, ignore_index=True)
+                rows.append(res)
             except Exception as err:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
-                errdf = pd.concat([errdf, pd.Series({"fname": f, "nameserver":key, "runtimeError": exc_type.__name__, "runtimeErrorInfo": exc_value}).to_frame().T],
-                                  ignore_index=True)
+                errors.append({"fname": f, "nameserver":key, "runtimeError": exc_type.__name__, "runtimeErrorInfo": exc_value})
                 print("ERROR LOG:", key, exc_type.__name__)
 
-        print(f, ":", df.shape)
-        print(f, "ERROR:", errdf.shape)
+        print(f, ":", len(rows))
+        print(f, "ERROR:", len(errors))
+
+    # build each frame once, concatenating row by row is quadratic
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    errdf = pd.DataFrame.from_records(errors, columns=ERROR_COLUMNS)
     return df, errdf   
 
 
@@ -98,7 +113,9 @@ def mltproc_parsing(flist, maxproc = psutil.cpu_count(logical = False), mute = F
 
 @click.command()
 @click.option("--dtime", default=None, help="Specify Date to Parse. Default None. If None, parse current date.")
-def cmd(dtime):
+@click.option("--refresh/--no-refresh", default=NSIP_INCREMENTAL, 
+              help="Record the answers in the refresh state of NameServerIP.db for the incremental sweep.")
+def cmd(dtime, refresh):
     """Query HTTPS DNS Records Data every Hour"""
 
     if dtime is None:
@@ -119,8 +136,7 @@ def cmd(dtime):
     CPUCOUNT = psutil.cpu_count(logical = False)
     print("Total physical CPUs:", CPUCOUNT)
     
-    fl = glob.glob(f"/data/nsIP/raw/{todaystr}/*.pickle")
-    fl.sort()
+    fl = list_raw_files(f"/data/nsIP/raw/{todaystr}")
     print("Total length:", len(fl))
 
     if len(fl) == 0:
@@ -134,6 +150,9 @@ def cmd(dtime):
     datadf, errtotal = mltproc_parsing(fl)
     datadf.to_csv(os.path.join(parsing_dir, "nsIP.csv"), index=False)
     errtotal.to_csv(os.path.join(parsing_dir, "nsIP_error.csv"), index=False)
+
+    if refresh and len(todaystr) == 10:
+        record_observations(datadf, todaystr)
         
 
 if __name__ == "__main__":
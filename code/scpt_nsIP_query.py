@@ -10,17 +10,25 @@ import datetime
 import psutil
 import sqlite3
 import json
+import itertools
+import functools
 
 # local import 
 from utils import Domain, CNameLoopsTooLong
-from config import MAXCONCURRENCY, RESOLVER_LIST, PARSE_DIR, NSIP_DB, NSIP_DIR
-from asyncquery import init_domain_list, query_all_nameserver_ip, get_resolver
+from config import (MAXCONCURRENCY, RESOLVER_LIST, PARSE_DIR, NSIP_DB, NSIP_DIR, NSIP_ACTIVE_DAYS,
+                    NSIP_SHARDS, NSIP_TARGET_RATE, NSIP_INCREMENTAL)
+from asyncquery import init_domain_list, query_all_nameserver_ip, get_resolver, close_socket_pools, get_semaphore
+from rawstore import open_results, close_results, RAW_EXT
+from parsedstore import read_parsed
+from dbschema import connect, read_table, upsert_seen, NSIP_TABLES
+from hashring import HashRing, shard_key
+from nsrefresh import plan_refresh, mark_full_sweep
 
 from itertools import islice
 import multiprocessing
 
 
-def singlecore_nsquerying(df_dict):
+def singlecore_nsquerying(df_dict, rate=None):
     today = datetime.datetime.now()
     todaystr = today.strftime("%Y-%m-%d")
     
@@ -34,9 +42,9 @@ def singlecore_nsquerying(df_dict):
         os.mkdir(OUT_DIR)
         print("Create folder:", OUT_DIR)
 
-    file_fmt = os.path.join(OUT_DIR, "output_{:03d}.pickle")
+    file_fmt = os.path.join(OUT_DIR, "output_{:03d}" + RAW_EXT)
 
-    sem = asyncio.Semaphore(MAXCONCURRENCY)
+    sem = get_semaphore()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -52,134 +60,99 @@ def singlecore_nsquerying(df_dict):
         print("OUTPUT FILE PATH:", outfpath)
         
         resolver = get_resolver(addresses=RESOLVER_LIST)
-        RESULTS = dict()
+        RESULTS = open_results(outfpath)
         
         print("start query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
         s = time.perf_counter()
 
-        loop.run_until_complete(query_all_nameserver_ip(domains=dom_l, resolver=resolver, sem=sem, data_dict=RESULTS))
+        loop.run_until_complete(query_all_nameserver_ip(domains=dom_l, resolver=resolver, sem=sem, data_dict=RESULTS,
+                                                        rate=rate))
 
         elapsed = time.perf_counter() - s
         print(f"{__file__} executed in {elapsed:0.6f} seconds.")
+        print("Nameservers per second:", round(len(dom_l) / elapsed, 1))
 
         print("end query", datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-        with open(outfpath, 'wb') as outfile:
-            pickle.dump(RESULTS, outfile)
+        close_results(RESULTS, outfpath)
+    
+    close_socket_pools()
     
     loop.run_until_complete(loop.shutdown_asyncgens())
     loop.close()
     return 0
 
 
-def mltproc_nsquerying(nshist, maxproc = psutil.cpu_count(logical = False), mute = False):
+def mltproc_nsquerying(nshist, maxproc = psutil.cpu_count(logical = False), mute = False, 
+                       nshards = NSIP_SHARDS, target_rate = NSIP_TARGET_RATE):
 
     pool = multiprocessing.Pool(processes = maxproc)
 
-    # split into smaller df 
-    #MOD = 2
-    #MAXSPLIT = MOD * maxproc
-    
-    ## Switch to single core
-    MAXSPLIT = 1
-    
-    # query apex
-    df_list = np.array_split(nshist, MAXSPLIT)
-
-    data_dict = {}
-    proc_list = []
-    for i in range(MAXSPLIT):
-        data_dict[i]= df_list[i]
-        #if len(data_dict) == MOD:
-        proc_list.append(data_dict)
-        
-    res = pool.map(singlecore_nsquerying, proc_list)
+    # shard the nameservers on a consistent hash ring of their parent domain, so a nameserver
+    # (and its provider's other nameservers) always lands on the same shard and output file
+    if nshards is None:
+        nshards = 4 * maxproc
+    ring = HashRing(range(nshards))
+    keys = nshist["nameserver"].map(shard_key)
+    nshist = nshist.assign(shardkey=keys, shard=keys.map(ring.node_for)).sort_values("shardkey")
+
+    proc_list = [{shard: df} for shard, df in nshist.groupby("shard")]
+    print("Shards:", len(proc_list), ",Largest shard:", max([len(df) for d in proc_list for df in d.values()], default=0))
+
+    # maxproc shards run at a time, each gets an equal part of the target rate
+    rate = target_rate / maxproc if target_rate is not None else None
+    res = pool.map(functools.partial(singlecore_nsquerying, rate=rate), proc_list, chunksize=1)
     
     print ("finished query")
     return 0 
 
 
-def get_ns_df(datadf: pd.DataFrame):
-    ## get non dup nameservers from daily dataframes
-    datadf = datadf.loc[datadf["error"]=="{}"]
-    datadf = datadf.loc[~datadf["ns"].isna()][["ns"]]
-    datadf["nameserver"] = datadf["ns"].apply(lambda x: json.loads(x)["NS"])
-    tmpdf = datadf.explode("nameserver")[["nameserver"]]
-    tmpdf = tmpdf.drop_duplicates()
-    
-    return tmpdf
+def extract_nameservers(nscol: pd.Series) -> list:
+    ## nameserver names of an ns column (parsedstore.read_parsed), flattened
+    ## the column holds JSON strings when read from csv, lists when read from parquet
+    nscol = nscol.dropna()
+    if len(nscol) == 0:
+        return []
+    if isinstance(nscol.iloc[0], str):
+        # one json.loads over the whole column instead of one per row
+        parsed = json.loads("[" + ",".join(nscol) + "]")
+        return list(itertools.chain.from_iterable([item["NS"] for item in parsed]))
+    return list(itertools.chain.from_iterable(nscol))
 
 
-def upsert_nameserver(ns, logday, dbcursor):
-    
-    if not type(ns)==str:
-        return -1
-    
-    dbcursor.execute("""SELECT EXISTS(SELECT 1 FROM nameservers WHERE nameserver=?);""", (ns,))
-    hasrecord = dbcursor.fetchone()[0]
-
-    if hasrecord == 0:  # insert new entry
-        dbcursor.execute("""INSERT INTO nameservers VALUES (?,?,?)""", (ns, logday, logday))
-    elif hasrecord == 1:
-        #print("hasrecord")
-        dbcursor.execute("""UPDATE nameservers SET last_seen=? WHERE nameserver=?""", (logday, ns))
-    else:
-        print("HAS RECORD ERROR...")
-        return -1
-    return 0
+def normalize_nameservers(names) -> pd.Series:
+    ## lowercase, absolute (trailing dot) and deduplicated nameserver names
+    names = pd.Series(names, dtype=object).dropna().astype(str).str.lower()
+    names = names.str.rstrip(".") + "."
+    names = names.loc[names != "."]
+    return names.drop_duplicates()
 
 
 def update_database(logday, dbfpath=NSIP_DB, datadir=PARSE_DIR):
     ## Update nameserver database using the data on logday
-    ## Connecting to database
-    conn = sqlite3.connect(dbfpath)
-    dbcursor = conn.cursor()
-    
-    ## loading parsed data
-    apexfpath = os.path.join(datadir, logday, "apex_https.csv")
-    apexdf = pd.read_csv(apexfpath)
-    print("Loaded Data From:", apexfpath)
-    
-    ## preprocess
-    nsdf = get_ns_df(apexdf)
-    print("Processed Data From:", apexfpath)
-
-    ## insert entry
-    cnt = 0
-    for idx, item in nsdf.iterrows():
-        if cnt % 1000 == 0:
-            print(idx, item["nameserver"], logday)
-        upsert_nameserver(item["nameserver"], logday, dbcursor)
-        cnt += 1
-        
-    ## update nameserver db using www df
-    wwwfpath = os.path.join(datadir, logday, "www_https.csv")
-    wwwdf = pd.read_csv(wwwfpath)
-    print("Loaded Data From:", wwwfpath)
-    
-    ## preprocess
-    nsdf = get_ns_df(wwwdf)
-    print("Processed Data From:", wwwfpath)
-    print("Processed data shape:", nsdf.shape)
-    
-    cnt = 0
-    for idx, item in nsdf.iterrows():
-        if cnt % 1000 == 0:
-            print(idx, item["nameserver"], logday)
-        upsert_nameserver(item["nameserver"], logday, dbcursor)
-        cnt += 1
-
+    ## nameservers of apex and www domains are deduplicated together and upserted in one batch
+    names = []
+    for dtype in ["apex", "www"]:
+        datadf = read_parsed(logday, dtype, columns=["ns"], status="ok", parsedir=datadir)
+        names.extend(extract_nameservers(datadf["ns"]))
+        print("Processed", dtype, "data of:", logday)
+    nameservers = normalize_nameservers(names)
+    print("Distinct nameservers:", len(nameservers))
+
+    conn = connect(dbfpath, NSIP_TABLES)
+    cnt = upsert_seen(conn, "nameservers", nameservers, logday)
+    print("Upserted", cnt, "rows into nameservers")
     conn.commit()
     conn.close()
     return 0
 
-def get_ns_table(dtype="ns", dbfpath=NSIP_DB):
-    conn = sqlite3.connect(dbfpath)
+def get_ns_table(dtype="ns", dbfpath=NSIP_DB, active_days=None):
+    ## nameserver table, only the nameservers seen in the last active_days days if given
+    conn = connect(dbfpath, NSIP_TABLES)
     if dtype == "ns":
-        resdf = pd.read_sql_query("SELECT * from nameservers", conn)
+        resdf = read_table(conn, "nameservers", active_days)
 
-    conn.commit()
     conn.close()
     return resdf
 
@@ -197,9 +170,15 @@ if __name__ == "__main__":
     ### Update NameServerIP Database
     update_database(todaystr)
     
-    nshist = get_ns_table()
+    nshist = get_ns_table(active_days=NSIP_ACTIVE_DAYS)
+    full_sweep = False
+    if NSIP_INCREMENTAL:
+        nshist, full_sweep = plan_refresh(nshist, todaystr)
     nshist["rank"] = -1
     print("ns table shape:", nshist.shape)
     print(nshist.head(1))
 
     mltproc_nsquerying(nshist=nshist)
+    # only a sweep that ran to the end counts, an interrupted one is repeated the next day
+    if full_sweep:
+        mark_full_sweep(todaystr)
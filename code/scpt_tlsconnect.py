@@ -0,0 +1,51 @@
+import os
+import asyncio
+import time
+import datetime
+import click
+
+# local import
+from config import TLS_DIR, TLS_MAXCONCURRENCY
+from asyncquery import run_worker_pool
+from asyncTLSconnection import read_probe_jobs, probe_job_done, run_probe_job
+
+
+async def probe_all(jobs: list, tlsdir: str, logday: str, nworkers: int = TLS_MAXCONCURRENCY):
+    """
+    Wrap function to run all probe jobs with a pool of TLS workers
+    """
+    await run_worker_pool(jobs, lambda job: run_probe_job(job, tlsdir, logday), nworkers)
+
+
+@click.command()
+@click.option("--date", default=None, help="Specify Date to Probe. Default None. If None, probe current date.")
+def cmd(date):
+    """Run the TLS probe jobs queued by the DNS query stage"""
+
+    if date is None:
+        today = datetime.datetime.now()
+        todaystr = today.strftime("%Y-%m-%d")
+    else:
+        try:
+            ## test if argument date is correct format:
+            today = datetime.datetime.strptime(date, "%Y-%m-%d")
+            todaystr = date
+        except ValueError as ve:
+            print(f'You entered {date}, which is not a valid date format(%Y-%m-%d).')
+            return 1
+
+    jobs = read_probe_jobs(TLS_DIR, todaystr)
+    print("Total probe jobs:", len(jobs))
+    # jobs whose results are all saved were done by an earlier run
+    jobs = [job for job in jobs if not probe_job_done(job, TLS_DIR, todaystr)]
+    print("Remaining probe jobs:", len(jobs))
+
+    s = time.perf_counter()
+    asyncio.run(probe_all(jobs, TLS_DIR, todaystr))
+    elapsed = time.perf_counter() - s
+    print(f"{__file__} executed in {elapsed:0.6f} seconds.")
+    return 0
+
+
+if __name__ == "__main__":
+    cmd()
@@ -6,6 +6,9 @@ import subprocess
 
 TRANCO_DIR = "/data/tranco"
 LOG_DIR = "/data/log"
+MAX_RETRY = 3
+# multiproc_query.py exits with this code when --resume finds a manifest of another run
+MANIFEST_MISMATCH = 3
 
 if __name__ == "__main__":
 
@@ -29,5 +32,15 @@ if __name__ == "__main__":
 
     myoutput = open(os.path.join(logdir,'query.log'), 'w')
     query_str = "python /home/ubuntu/dnsstudy/code/multiproc_query.py"
-    subprocess.run(query_str, shell=True, stdout=myoutput)
+    res = subprocess.run(query_str, shell=True, stdout=myoutput)
+
+    # a failed run is continued from its checkpoints instead of starting over
+    retry = 0
+    while res.returncode != 0 and retry < MAX_RETRY:
+        if res.returncode == MANIFEST_MISMATCH:
+            print("query checkpoints do not match this run, not resuming")
+            break
+        retry += 1
+        print("query failed with code", res.returncode, ", resume attempt", retry)
+        res = subprocess.run(query_str + " --resume --date=" + todaystr, shell=True, stdout=myoutput)
 
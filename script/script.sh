@@ -5,6 +5,7 @@ python /home/ubuntu/dnsstudy/script/dailyquery.py >> /home/ubuntu/dnsstudy/scrip
 
 python /home/ubuntu/dnsstudy/code/multi_parsing.py --dtype=www >> /home/ubuntu/dnsstudy/script/cronparsing.log 2>&1
 python /home/ubuntu/dnsstudy/code/multi_parsing.py --dtype=apex >> /home/ubuntu/dnsstudy/script/cronparsing.log 2>&1
+python /home/ubuntu/dnsstudy/code/parsedindex.py build >> /home/ubuntu/dnsstudy/script/cronparsing.log 2>&1
 
 python /home/ubuntu/dnsstudy/code/scpt_hist_query.py 
 
@@ -0,0 +1,41 @@
+import rawstore
+from checkpoint import (chunk_status, load_manifest, recover_record_file, summarize_progress,
+                        write_manifest)
+from rawstore import encode_domain, load_records
+from test_rawstore import _domain
+
+
+def test_manifest_round_trip(tmp_path):
+    assert load_manifest(str(tmp_path)) is None
+    write_manifest(str(tmp_path), 3, [4, 4, 3])
+    manifest = load_manifest(str(tmp_path))
+    assert (manifest["maxsplit"], manifest["total"]) == (3, 11)
+    assert manifest["chunks"] == [[0, 4], [4, 8], [8, 11]]
+
+
+def test_chunk_status(tmp_path):
+    fmt = str(tmp_path / "output_{:03d}.rec")
+    with rawstore.StreamingWriter(fmt.format(0)) as writer:
+        writer["example.com"] = _domain("example.com", 1)
+    rawstore.StreamingWriter(fmt.format(1)).close(complete=False)
+
+    assert [chunk_status(fmt.format(key)) for key in range(3)] == ["done", "partial", "todo"]
+    assert summarize_progress([fmt], range(3)) == {"done": 1, "partial": 1, "todo": 1}
+
+
+def test_recover_record_file(tmp_path):
+    fpath = str(tmp_path / "output_000.rec")
+    names = ["example.com", "example.org", "example.net"]
+    data = b"".join([encode_domain(_domain(name, rank)) for rank, name in enumerate(names)])
+    # the crash cut the last record of example.net in half
+    with open(fpath, "wb") as outfile:
+        outfile.write(data[:-20])
+
+    # the records of the last domain may be incomplete, so it is dropped even if some are whole
+    assert recover_record_file(fpath) == {"example.com", "example.org"}
+    assert list(load_records(fpath).keys()) == ["example.com", "example.org"]
+
+    with rawstore.StreamingWriter(fpath, append=True) as writer:
+        writer["example.net"] = _domain("example.net", 2)
+    assert list(load_records(fpath).keys()) == names
+    assert load_records(fpath)["example.net"].error == _domain("example.net", 2).error
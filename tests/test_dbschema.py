@@ -0,0 +1,66 @@
+import sqlite3
+
+import pandas as pd
+
+import dbschema
+from scpt_nsIP_query import extract_nameservers, normalize_nameservers
+
+
+def _legacy_table(dbfpath: str, table: str, key: str, rows: list, version: int = 0):
+    conn = sqlite3.connect(dbfpath)
+    conn.execute(f"CREATE TABLE {table} ({key} TEXT, first_seen TEXT, last_seen TEXT)")
+    conn.executemany(f"INSERT INTO {table} VALUES (?,?,?)", rows)
+    conn.execute(f"PRAGMA user_version={version}")
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_table_merges_duplicates(tmp_path):
+    dbfpath = str(tmp_path / "history.db")
+    _legacy_table(dbfpath, "apexhistory", "apex", [("example.com", "2023-08-15", "2023-08-15"),
+                                                   ("example.com", "2023-08-16", "2024-01-02"),
+                                                   ("example.org", "2023-09-01", "2023-09-01")])
+    conn = dbschema.connect(dbfpath, dbschema.HIST_TABLES)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == dbschema.SCHEMA_VERSION
+    assert conn.execute("SELECT * FROM apexhistory ORDER BY apex").fetchall() == [
+        ("example.com", "2023-08-15", "2024-01-02"), ("example.org", "2023-09-01", "2023-09-01")]
+    # the key is now the primary key
+    info = conn.execute("PRAGMA table_info(apexhistory)").fetchall()
+    assert [col[5] for col in info if col[1] == "apex"] == [1]
+    assert conn.execute("SELECT * FROM wwwhistory").fetchall() == []
+
+
+def test_upsert_seen_and_active_window(tmp_path):
+    conn = dbschema.connect(str(tmp_path / "history.db"), dbschema.HIST_TABLES)
+    with conn:
+        dbschema.upsert_seen(conn, "apexhistory", ["example.com", "example.org"], "2026-01-01")
+        dbschema.upsert_seen(conn, "apexhistory", ["example.com", "example.com"], "2026-01-10")
+    assert conn.execute("SELECT * FROM apexhistory ORDER BY apex").fetchall() == [
+        ("example.com", "2026-01-01", "2026-01-10"), ("example.org", "2026-01-01", "2026-01-01")]
+    active = dbschema.read_table(conn, "apexhistory", active_days=5, logday="2026-01-10")
+    assert list(active["apex"]) == ["example.com"]
+
+
+def test_nameserver_names_normalized(tmp_path):
+    dbfpath = str(tmp_path / "NameServerIP.db")
+    _legacy_table(dbfpath, "nameservers", "nameserver", [("NS1.Example.net", "2023-10-11", "2024-05-01"),
+                                                         ("ns1.example.net.", "2023-12-01", "2025-01-01"),
+                                                         ("ns2.example.net.", "2023-10-11", "2023-10-12")], version=1)
+    conn = dbschema.connect(dbfpath, dbschema.NSIP_TABLES)
+    assert conn.execute("SELECT * FROM nameservers ORDER BY nameserver").fetchall() == [
+        ("ns1.example.net.", "2023-10-11", "2025-01-01"), ("ns2.example.net.", "2023-10-11", "2023-10-12")]
+    conn.close()
+
+    # runs once: a later connect leaves new rows alone
+    conn = dbschema.connect(dbfpath, dbschema.NSIP_TABLES)
+    with conn:
+        conn.execute("INSERT INTO nameservers VALUES ('NS3.example.net', '2026-01-01', '2026-01-01')")
+    conn.close()
+    conn = dbschema.connect(dbfpath, dbschema.NSIP_TABLES)
+    assert conn.execute("SELECT COUNT(*) FROM nameservers").fetchone()[0] == 3
+
+
+def test_normalize_nameservers():
+    names = extract_nameservers(pd.Series(['{"NS": ["NS1.example.net.", "ns2.example.net"]}', None,
+                                           '{"NS": ["ns1.example.net."]}']))
+    assert list(normalize_nameservers(names)) == ["ns1.example.net.", "ns2.example.net."]
@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+import time
+
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+
+import dnscache
+from dnscache import AnswerCache, CachingResolver, zone_for_name
+
+
+def _answer(qname: str, rdtype: str, text: str, ttl: int = 300) -> dns.resolver.Answer:
+    query = dns.message.make_query(qname, rdtype)
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(qname, ttl, "IN", rdtype, text))
+    # parse the wire back, find_rrset() does not see rrsets appended to a section
+    response = dns.message.from_wire(response.to_wire())
+    return dns.resolver.Answer(dns.name.from_text(qname), dns.rdatatype.from_text(rdtype), dns.rdataclass.IN, response, "192.0.2.53")
+
+
+class _Resolver:
+    """answers SOA for the zones, NODATA with the zone SOA in the authority section below them"""
+    def __init__(self, zones):
+        self.zones = [dns.name.from_text(zone) for zone in zones]
+        self.calls = []
+
+    async def resolve(self, qname, rdtype="A", rdclass=1, raise_on_no_answer=True):
+        if isinstance(qname, str):
+            qname = dns.name.from_text(qname)
+        self.calls.append((qname.to_text(), rdtype))
+        await asyncio.sleep(0.01)
+        if qname in self.zones:
+            return _answer(qname.to_text(), "SOA", "ns. host. 1 2 3 4 5")
+        response = dns.message.make_response(dns.message.make_query(qname, rdtype))
+        zone = [zone for zone in self.zones if qname.is_subdomain(zone)][0]
+        response.authority.append(dns.rrset.from_text(zone, 300, "IN", "SOA", "ns. host. 1 2 3 4 5"))
+        response = dns.message.from_wire(response.to_wire())
+        return dns.resolver.Answer(qname, dns.rdatatype.from_text(rdtype), dns.rdataclass.IN, response, "192.0.2.53")
+
+
+def test_lru_eviction_and_expiry():
+    cache = AnswerCache(maxsize=2, max_ttl=60)
+    cache.put(("a.", "NS"), "a", 60)
+    cache.put(("b.", "NS"), "b", 60)
+    assert cache.get(("a.", "NS")) == "a"
+    cache.put(("c.", "NS"), "c", 60)    # evicts b, the least recently used
+    assert cache.get(("b.", "NS")) is None
+    assert cache.get(("a.", "NS")) == "a"
+
+    cache.put(("d.", "NS"), "d", 0)     # not cached at all
+    assert cache.get(("d.", "NS")) is None
+    cache.entries[("a.", "NS")] = ("a", time.time() - 1)
+    assert cache.get(("a.", "NS")) is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_caching_resolver_shares_inflight_queries():
+    async def run():
+        upstream = _Resolver(["example.com."])
+        resolver = CachingResolver(upstream, AnswerCache())
+        answers = await asyncio.gather(*[resolver.resolve("example.com.", "SOA") for _ in range(5)])
+        await resolver.resolve("EXAMPLE.com.", "SOA")
+        return upstream.calls, answers
+
+    calls, answers = asyncio.run(run())
+    assert calls == [("example.com.", "SOA")]
+    assert all([answer is answers[0] for answer in answers])
+
+
+def test_zone_for_name_walks_up_and_memoizes():
+    dnscache._ZONE_CACHE = None
+    upstream = _Resolver(["example.com."])
+    zone = asyncio.run(zone_for_name("www.example.com.", upstream))
+    assert zone == dns.name.from_text("example.com.")
+    # the NODATA answer of www.example.com names the zone, no need to query the parent
+    assert upstream.calls == [("www.example.com.", "SOA")]
+
+    asyncio.run(zone_for_name("www.example.com.", upstream))
+    assert len(upstream.calls) == 1
+
+
+def test_shared_cache_batches_writes(tmp_path):
+    dbfpath = str(tmp_path / "cache.sqlite")
+    writer = dnscache.SharedAnswerCache(dbfpath, flush_entries=2, flush_seconds=3600)
+    writer.put(("example.com.", "NS"), _answer("example.com.", "NS", "ns1.example.net."), 300)
+    assert len(writer.pending) == 1
+
+    reader = dnscache.SharedAnswerCache(dbfpath)
+    assert reader.get(("example.com.", "NS")) is None
+
+    writer.put(("example.org.", "NS"), _answer("example.org.", "NS", "ns1.example.net."), 300)
+    assert len(writer.pending) == 0
+    answer = dnscache.SharedAnswerCache(dbfpath).get(("example.com.", "NS"))
+    assert answer.rrset[0].target.to_text() == "ns1.example.net."
+
+
+def test_shared_cache_retries_writes_on_a_locked_file(tmp_path):
+    dbfpath = str(tmp_path / "cache.sqlite")
+    cache = dnscache.SharedAnswerCache(dbfpath, flush_entries=1, busy_ms=1)
+    cache.connect()
+
+    other = sqlite3.connect(dbfpath, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    cache.put(("example.com.", "NS"), _answer("example.com.", "NS", "ns1.example.net."), 300)
+    assert len(cache.pending) == 1 and cache.stats()["locked"] == 1
+    other.execute("COMMIT")
+
+    cache.flush()
+    assert len(cache.pending) == 0
@@ -0,0 +1,68 @@
+import asyncio
+
+import dns.message
+import dns.resolver
+import dns.rrset
+import pytest
+
+from dnsengine import RawResolver, close_socket_pools
+
+
+class _FakeServer(asyncio.DatagramProtocol):
+    """answers A queries with 10.0.0.<id mod 256>, holding back the first query until the second arrives"""
+    def __init__(self):
+        self.held = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def answer(self, query, addr):
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 60, "IN", "A",
+                                                   f"10.0.0.{query.id % 256}"))
+        self.transport.sendto(response.to_wire(), addr)
+
+    def datagram_received(self, data, addr):
+        query = dns.message.from_wire(data)
+        # a stray datagram with an unknown ID must be ignored by the client
+        self.transport.sendto(b"\xff\xff" + b"\x00" * 10, addr)
+        if self.held is None:
+            self.held = (query, addr)
+            return
+        self.answer(query, addr)
+        self.answer(*self.held)
+
+
+async def _resolve_two():
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(_FakeServer, local_addr=("127.0.0.1", 0))
+    port = transport.get_extra_info("sockname")[1]
+    try:
+        resolver = RawResolver(["127.0.0.1"], lifetime=2, port=port, timeout=2)
+        return await asyncio.gather(resolver.resolve("a.example.", "A"), resolver.resolve("b.example.", "A"))
+    finally:
+        close_socket_pools()
+        transport.close()
+
+
+def test_responses_matched_by_query_id():
+    answers = asyncio.run(_resolve_two())
+    for answer, name in zip(answers, ["a.example.", "b.example."]):
+        assert answer.qname.to_text() == name
+        assert answer.rrset.name.to_text() == name
+        assert answer.rrset[0].address == f"10.0.0.{answer.response.id % 256}"
+
+
+def test_lifetime_timeout():
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=("127.0.0.1", 0))
+        port = transport.get_extra_info("sockname")[1]
+        try:
+            await RawResolver(["127.0.0.1"], lifetime=0.3, port=port, timeout=0.1).resolve("a.example.", "A")
+        finally:
+            close_socket_pools()
+            transport.close()
+
+    with pytest.raises(dns.resolver.LifetimeTimeout):
+        asyncio.run(run())
@@ -0,0 +1,23 @@
+import dns.rdata
+import dns.rdtypes.svcbbase
+
+from dnsrecords import SVCBRecord, _svcb_docpath
+
+
+def _params(text: str):
+    return dns.rdata.from_text("IN", "HTTPS", text).params
+
+
+def test_svcb_params():
+    parsed = SVCBRecord(_params('1 . alpn="h2,h3" port=8443 ipv4hint=192.0.2.1 key65000=abc')).parsed
+    assert parsed["alph"] == "h2,h3"
+    assert parsed["port"] == 8443
+    assert parsed["ipv4hint"] == "192.0.2.1"
+    assert parsed["key65000"] == b"abc".hex()
+
+
+def test_docpath_from_generic_param():
+    # dnspython without native key10 support keeps the raw length-prefixed segments
+    generic = dns.rdtypes.svcbbase.GenericParam(b"\x03dns\x05query")
+    assert _svcb_docpath(generic) == ["dns", "query"]
+    assert _svcb_docpath(dns.rdtypes.svcbbase.GenericParam(b"")) == []
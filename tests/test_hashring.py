@@ -0,0 +1,35 @@
+import collections
+
+from hashring import HashRing, shard_key, stable_hash
+
+KEYS = [f"ns{idx}.provider{idx % 997}.net" for idx in range(20000)]
+
+
+def test_stable_hash_is_fixed():
+    # must not change between runs or processes, unlike hash()
+    assert stable_hash("example.net") == 0x440dc4199edfcc0
+
+
+def test_ring_is_deterministic_and_balanced():
+    ring = HashRing(range(16))
+    again = HashRing(range(16))
+    assert [ring.node_for(key) for key in KEYS] == [again.node_for(key) for key in KEYS]
+    counts = collections.Counter([ring.node_for(key) for key in KEYS])
+    assert len(counts) == 16
+    assert max(counts.values()) < 2 * len(KEYS) / 16
+
+
+def test_adding_a_node_moves_few_keys():
+    before = HashRing(range(16))
+    after = HashRing(range(17))
+    moved = [key for key in KEYS if before.node_for(key) != after.node_for(key)]
+    # only keys taken over by the new node move
+    assert all([after.node_for(key) == 16 for key in moved])
+    assert len(moved) < 2 * len(KEYS) / 17
+
+
+def test_shard_key():
+    assert shard_key("NS1.Example.net.") == "example.net"
+    assert shard_key("ns2.dns.example.co.uk") == "dns.example.co.uk"
+    assert shard_key("example.net") == "example.net"
+    assert shard_key("localhost") == "localhost"
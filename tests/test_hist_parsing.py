@@ -0,0 +1,80 @@
+import functools
+import os
+
+from click.testing import CliRunner
+
+import histdelta
+import scpt_hist_parsing
+from checkpoint import unfinished_chunks, write_manifest
+from rawstore import StreamingWriter
+from test_rawstore import _domain
+
+LOGDAY = "2026-10-02"
+
+
+def _query_day(rawdir: str, chunks: list, complete: list):
+    """raw files of a history query run; chunks of domains, complete marks the finished ones"""
+    os.makedirs(rawdir)
+    write_manifest(rawdir, len(chunks), [len(chunk) for chunk in chunks])
+    for idx, (chunk, done) in enumerate(zip(chunks, complete)):
+        if done is None: # never started
+            continue
+        writer = StreamingWriter(os.path.join(rawdir, "output_{:03d}.rec".format(idx)))
+        for rank, name in enumerate(chunk):
+            writer[name] = _domain(name, rank)
+        writer.close(complete=done)
+
+
+def _parse(tmp_path, monkeypatch, chunks, complete, *args):
+    dbfpath = str(tmp_path / "delta.db")
+    histdir = tmp_path / "raw"
+    _query_day(str(histdir / LOGDAY / "apex"), chunks, complete)
+    (tmp_path / "parsed").mkdir(exist_ok=True)
+    monkeypatch.setattr(scpt_hist_parsing, "HIST_DIR", str(histdir))
+    monkeypatch.setattr(scpt_hist_parsing, "HIST_PARSED", str(tmp_path / "parsed"))
+    monkeypatch.setattr(scpt_hist_parsing, "record_snapshot",
+                        functools.partial(histdelta.record_snapshot, dbfpath=dbfpath))
+    monkeypatch.setattr(scpt_hist_parsing.psutil, "cpu_count", lambda logical=False: 1)
+    res = CliRunner().invoke(scpt_hist_parsing.cmd, ["--dtime", LOGDAY, "--store", "delta"] + list(args))
+    assert res.exit_code == 0, res.output
+    return dbfpath, str(histdir / LOGDAY / "apex"), res.output
+
+
+def _track(dbfpath: str, domains: list):
+    """the domains as observed the day before"""
+    seed = scpt_hist_parsing.pd.DataFrame({"domain": domains, "ns": [None] * len(domains),
+                                           "soa": [None] * len(domains), "error": ["{}"] * len(domains)})
+    histdelta.record_snapshot(seed, "2026-10-01", "apex", dbfpath=dbfpath)
+
+
+def test_unfinished_chunks(tmp_path):
+    rawdir = str(tmp_path / "apex")
+    _query_day(rawdir, [["a.example"], ["b.example"], ["c.example"], []], [True, False, None, None])
+    assert unfinished_chunks(rawdir) == [os.path.join(rawdir, "output_001.rec"), os.path.join(rawdir, "output_002.rec")]
+
+
+def test_partial_run_marks_nobody_absent(tmp_path, monkeypatch):
+    dbfpath = str(tmp_path / "delta.db")
+    _track(dbfpath, ["a.example", "b.example", "c.example", "d.example"])
+
+    dbfpath, rawdir, output = _parse(tmp_path, monkeypatch, [["a.example"], ["b.example"], ["c.example"]],
+                                     [True, False, None], "--prune-raw")
+    assert "unfinished query chunks: 2" in output
+    assert "WARNING: raw files kept" in output
+    assert os.path.exists(rawdir)
+
+    state = histdelta.state_as_of(LOGDAY, "apex", include_absent=True, dbfpath=dbfpath)
+    assert (state["error"] == histdelta.ABSENT).sum() == 0
+    # the finished domains are still recorded
+    assert set(state.loc[state["valid_from"] == LOGDAY, "domain"]) == {"a.example", "b.example"}
+
+
+def test_complete_run_marks_missing_domains_and_prunes(tmp_path, monkeypatch):
+    dbfpath = str(tmp_path / "delta.db")
+    _track(dbfpath, ["a.example", "b.example", "d.example"])
+
+    dbfpath, rawdir, output = _parse(tmp_path, monkeypatch, [["a.example"], ["b.example"]], [True, True],
+                                     "--prune-raw")
+    state = histdelta.state_as_of(LOGDAY, "apex", include_absent=True, dbfpath=dbfpath)
+    assert list(state.loc[state["error"] == histdelta.ABSENT, "domain"]) == ["d.example"]
+    assert not os.path.exists(rawdir)
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from histdelta import ABSENT, history_of, record_snapshot, state_as_of
+
+
+def _snapshot(ns: dict) -> pd.DataFrame:
+    return pd.DataFrame({"domain": list(ns.keys()),
+                         "ns": ['{"NS": %s}' % str(value).replace("'", '"') for value in ns.values()],
+                         "soa": [None] * len(ns),
+                         "error": ["{}"] * len(ns)})
+
+
+def test_only_changes_are_stored(tmp_path):
+    dbfpath = str(tmp_path / "delta.db")
+    assert record_snapshot(_snapshot({"example.com": ["a.", "b."]}), "2026-10-01", "apex", dbfpath=dbfpath) == 1
+    # same set of nameservers in another order is not a change
+    assert record_snapshot(_snapshot({"example.com": ["b.", "a."]}), "2026-10-02", "apex", dbfpath=dbfpath) == 0
+    assert record_snapshot(_snapshot({"example.com": ["c."]}), "2026-10-03", "apex", dbfpath=dbfpath) == 1
+
+    assert list(history_of("example.com", "apex", dbfpath)["valid_from"]) == ["2026-10-01", "2026-10-03"]
+    assert state_as_of("2026-10-02", "apex", dbfpath=dbfpath)["ns"].tolist() == ['{"NS": ["a.", "b."]}']
+    assert state_as_of("2026-10-05", "apex", dbfpath=dbfpath)["ns"].tolist() == ['{"NS": ["c."]}']
+    assert len(state_as_of("2026-09-30", "apex", dbfpath=dbfpath)) == 0
+    assert len(state_as_of("2026-10-05", "www", dbfpath=dbfpath)) == 0
+
+
+def test_missing_domains_get_a_tombstone(tmp_path):
+    dbfpath = str(tmp_path / "delta.db")
+    record_snapshot(_snapshot({"a.com": ["n."], "b.com": ["n."], "c.com": ["n."]}), "2026-10-01", "apex", dbfpath=dbfpath)
+    # c.com failed to parse, it is neither compared nor marked absent
+    record_snapshot(_snapshot({"a.com": ["n."]}), "2026-10-02", "apex", skipped=["c.com"], dbfpath=dbfpath)
+    record_snapshot(_snapshot({"a.com": ["n."], "b.com": ["n."]}), "2026-10-04", "apex", dbfpath=dbfpath)
+
+    def domains(logday, **kwargs):
+        return sorted(state_as_of(logday, "apex", dbfpath=dbfpath, **kwargs)["domain"])
+
+    assert domains("2026-10-01") == ["a.com", "b.com", "c.com"]
+    assert domains("2026-10-02") == ["a.com", "c.com"]
+    assert domains("2026-10-04") == ["a.com", "b.com"]
+    assert domains("2026-10-04", domains=["b.com", "c.com"]) == ["b.com"]
+    absent = state_as_of("2026-10-03", "apex", include_absent=True, dbfpath=dbfpath)
+    assert absent.loc[absent["error"] == ABSENT, "domain"].tolist() == ["b.com"]
+
+
+def test_backfill_before_latest_day_is_skipped(tmp_path, capsys):
+    dbfpath = str(tmp_path / "delta.db")
+    record_snapshot(_snapshot({"example.com": ["a."]}), "2026-10-05", "apex", dbfpath=dbfpath)
+    assert record_snapshot(_snapshot({"example.com": ["b."]}), "2026-10-01", "apex", dbfpath=dbfpath) == 0
+    assert "WARNING: skipped 1 domains" in capsys.readouterr().out
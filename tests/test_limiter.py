@@ -0,0 +1,44 @@
+import asyncio
+
+from limiter import AdaptiveLimiter
+
+
+def _window(limiter, latency, failed, count=20):
+    for _ in range(count):
+        limiter.observe(latency, failed)
+
+
+def test_additive_increase_while_healthy():
+    limiter = AdaptiveLimiter(initial=10, minimum=2, maximum=14, step=2)
+    _window(limiter, 0.1, False)
+    assert limiter.limit == 12
+    _window(limiter, 0.1, False)
+    _window(limiter, 0.1, False)
+    assert limiter.limit == 14
+
+
+def test_backoff_on_failures_and_latency():
+    limiter = AdaptiveLimiter(initial=10, minimum=2, maximum=100, backoff=0.5, failure_rate=0.1, latency_factor=2)
+    _window(limiter, 0.1, True)
+    assert limiter.limit == 5
+    _window(limiter, 1.0, False)
+    assert limiter.limit == 2.5
+    _window(limiter, 1.0, True)
+    assert limiter.limit == 2
+
+
+def test_limits_inflight():
+    async def run():
+        limiter = AdaptiveLimiter(initial=3, minimum=1, maximum=3)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            async with limiter:
+                peak = max(peak, limiter.inflight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[work() for _ in range(20)])
+        return peak, limiter.inflight
+
+    assert asyncio.run(run()) == (3, 0)
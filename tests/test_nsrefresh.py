@@ -0,0 +1,65 @@
+import datetime
+import json
+import sqlite3
+
+import pandas as pd
+
+import nsrefresh
+from nsrefresh import mark_full_sweep, plan_refresh, record_observations, refresh_interval
+
+NSHIST = pd.DataFrame({"nameserver": ["ns1.example.net.", "ns2.example.net.", "ns3.example.net."]})
+
+
+def _observations(a1: str = "192.0.2.1") -> pd.DataFrame:
+    return pd.DataFrame({"nameserver": ["ns1.example.net.", "ns2.example.net.", "ns3.example.net."],
+                         "a": [json.dumps({"A": [a1]}), json.dumps({"A": ["192.0.2.2"]}), None],
+                         "aaaa": [None, None, None],
+                         "ttl": [300, 5 * 86400, None],
+                         "error": [{}, {}, {"A": "LifetimeTimeout"}]})
+
+
+def _next_due(dbfpath: str) -> dict:
+    return dict(sqlite3.connect(dbfpath).execute("SELECT nameserver, next_due FROM nsrefresh").fetchall())
+
+
+def test_refresh_interval():
+    today = datetime.date(2026, 10, 10)
+    assert refresh_interval(300, today, today) == nsrefresh.NSIP_MIN_REFRESH_DAYS
+    assert refresh_interval(300, datetime.date(2026, 10, 2), today) == 4
+    assert refresh_interval(300, datetime.date(2020, 1, 1), today) == nsrefresh.NSIP_MAX_REFRESH_DAYS
+    assert refresh_interval(3 * 86400 + 1, today, today) == 4
+
+
+def test_full_sweep_until_marked(tmp_path):
+    dbfpath = str(tmp_path / "NameServerIP.db")
+    due, full = plan_refresh(NSHIST, "2026-10-01", dbfpath, full_sweep_days=7)
+    assert full and len(due) == 3
+    # the sweep did not finish, the next day sweeps again
+    assert plan_refresh(NSHIST, "2026-10-02", dbfpath, full_sweep_days=7)[1]
+
+    mark_full_sweep("2026-10-02", dbfpath)
+    assert not plan_refresh(NSHIST, "2026-10-03", dbfpath, full_sweep_days=7)[1]
+    assert plan_refresh(NSHIST, "2026-10-09", dbfpath, full_sweep_days=7)[1]
+
+
+def test_plan_follows_ttl_and_changes(tmp_path):
+    dbfpath = str(tmp_path / "NameServerIP.db")
+    mark_full_sweep("2026-10-01", dbfpath)
+    assert record_observations(_observations(), "2026-10-01", dbfpath) == 0
+    assert _next_due(dbfpath) == {"ns1.example.net.": "2026-10-02",     # new, minimum interval
+                                  "ns2.example.net.": "2026-10-06",     # TTL of 5 days
+                                  "ns3.example.net.": "2026-10-02"}     # failed, retried tomorrow
+
+    due, _ = plan_refresh(NSHIST, "2026-10-02", dbfpath, full_sweep_days=7)
+    assert list(due["nameserver"]) == ["ns1.example.net.", "ns3.example.net."]
+
+    # unchanged for 4 days: due again after 2
+    record_observations(_observations(), "2026-10-05", dbfpath)
+    assert _next_due(dbfpath)["ns1.example.net."] == "2026-10-07"
+    # changed: back to the minimum interval
+    assert record_observations(_observations("192.0.2.9"), "2026-10-07", dbfpath) == 1
+    assert _next_due(dbfpath)["ns1.example.net."] == "2026-10-08"
+
+    row = sqlite3.connect(dbfpath).execute(
+        "SELECT a, last_change, change_count FROM nsrefresh WHERE nameserver='ns1.example.net.'").fetchone()
+    assert row == ("192.0.2.9", "2026-10-07", 1)
@@ -0,0 +1,54 @@
+import pandas as pd
+
+from parsedindex import build_index, lookup, scan_rows
+
+HTTPS = ['{"HTTPS": [{"alph": "h2,h3", "port": 443}]}', '{"HTTPS": [{"target": "line\\nbreak, \\"quoted\\""}]}', None]
+
+
+def _parsed_day(parsedir, day: str, priority: int) -> str:
+    (parsedir / day).mkdir()
+    df = pd.DataFrame({"version": ["0.1"] * 3, "rank": [1, 2, 3],
+                       "domain": ["a.example", "b.example", "c.example"],
+                       "https": [HTTPS[0], HTTPS[1].replace("line", f"line{priority}"), HTTPS[2]],
+                       "error": ["{}", "{}", "{'HTTPS': 'NoAnswer'}"]})
+    fpath = str(parsedir / day / "apex_https.csv")
+    df.to_csv(fpath, index=False)
+    return fpath
+
+
+def test_scan_rows_with_quoted_commas_and_newlines(tmp_path):
+    fpath = _parsed_day(tmp_path, "2026-03-01", 0)
+    with open(fpath, "w") as outfile: # a literal line break inside a quoted field
+        outfile.write('domain,https\na.example,"x,\ny"\nb.example,"say ""hi"", bye"\nc.example,\n')
+    rows = list(scan_rows(fpath))
+    assert [row[0] for row in rows] == ["a.example", "b.example", "c.example"]
+
+    with open(fpath, "rb") as infile:
+        data = infile.read()
+    assert [data[offset: offset + length] for _, offset, length in rows] == [
+        b'a.example,"x,\ny"\n', b'b.example,"say ""hi"", bye"\n', b"c.example,\n"]
+
+
+def test_build_is_incremental_and_lookup_reads_rows(tmp_path):
+    parsedir = tmp_path / "parsed"
+    parsedir.mkdir()
+    dbfpath = str(tmp_path / "index.db")
+    for idx, day in enumerate(["2026-03-01", "2026-03-02", "2026-04-01"]):
+        _parsed_day(parsedir, day, idx)
+    (parsedir / "notaday").mkdir()
+
+    assert build_index(["apex"], str(parsedir), dbfpath) == 3
+    assert build_index(["apex"], str(parsedir), dbfpath) == 0
+
+    df = lookup("b.example", "2026-03-01", "2026-03-31", "apex", str(parsedir), dbfpath)
+    assert list(df["day"]) == ["2026-03-01", "2026-03-02"]
+    assert list(df["https"]) == [HTTPS[1].replace("line", "line0"), HTTPS[1].replace("line", "line1")]
+    assert list(df.columns) == ["day", "version", "rank", "domain", "https", "error"]
+
+    # a day parsed again is indexed again
+    fpath = parsedir / "2026-04-01" / "apex_https.csv"
+    pd.DataFrame({"version": ["0.2"], "rank": [9], "domain": ["b.example"], "https": [None],
+                  "error": ["{}"]}).to_csv(fpath, index=False)
+    assert build_index(["apex"], str(parsedir), dbfpath) == 1
+    assert list(lookup("a.example", "2026-04-01", None, "apex", str(parsedir), dbfpath)["day"]) == []
+    assert list(lookup("b.example", "2026-04-01", None, "apex", str(parsedir), dbfpath)["rank"]) == [9]
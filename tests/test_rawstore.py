@@ -0,0 +1,82 @@
+import dns.message
+import dns.rrset
+
+import rawstore
+from rawstore import decode_record, encode_record, load_records, write_records
+from utils import Domain
+
+
+def _response(qname: str, rdtype: str, text: str) -> dns.message.Message:
+    response = dns.message.make_response(dns.message.make_query(qname, rdtype, use_edns=0))
+    response.answer.append(dns.rrset.from_text(qname, 300, "IN", rdtype, text))
+    return dns.message.from_wire(response.to_wire())
+
+
+def _domain(name: str, rank: int) -> Domain:
+    domain = Domain(name, rank)
+    domain.cname = "cdn." + name
+    domain.message["NS"] = _response(name + ".", "NS", "ns1.example.net.")
+    domain.message["A"] = _response(name + ".", "A", "192.0.2.1")
+    domain.error["HTTPS"] = "LifetimeTimeout"
+    domain.error["SOA"] = "SomethingNew"
+    return domain
+
+
+def test_record_round_trip():
+    record = encode_record(7, "example.com", None, "HTTPS", 2, "Unlisted", 1.5, b"wire")
+    rec = decode_record(record[rawstore.RECORD_LEN.size:])
+    assert rec == rawstore.RawRecord(7, "example.com", None, "HTTPS", 2, "Unlisted", 1.5, b"wire")
+
+
+def test_domain_round_trip(tmp_path):
+    fpath = str(tmp_path / "output_000.rec")
+    domains = {name: _domain(name, rank) for rank, name in enumerate(["example.com", "example.org"])}
+    write_records(domains, fpath)
+
+    loaded = load_records(fpath)
+    assert list(loaded.keys()) == ["example.com", "example.org"]
+    for name, domain in domains.items():
+        got = loaded[name]
+        assert (got.rank, got.cname, got.error) == (domain.rank, domain.cname, domain.error)
+        assert set(got.message.keys()) == {"NS", "A"}
+        assert got.message["A"].answer == domain.message["A"].answer
+        assert got.message["NS"].rcode() == 0
+
+    projected = load_records(fpath, qtypes=["NS"])
+    assert set(projected["example.com"].message.keys()) == {"NS"}
+    assert projected["example.com"].error == domains["example.com"].error
+
+
+def test_truncated_tail_is_ignored(tmp_path):
+    fpath = str(tmp_path / "output_000.rec")
+    write_records({"example.com": _domain("example.com", 1)}, fpath)
+    with open(fpath, "ab") as outfile:
+        outfile.write(encode_record(2, "example.org", None, "NS", 0, None, 1.0, b"x" * 40)[:-10])
+    assert list(load_records(fpath).keys()) == ["example.com"]
+
+
+def test_streaming_writer_marks_completion(tmp_path):
+    fpath = str(tmp_path / "output_000.rec")
+    with rawstore.StreamingWriter(fpath, flush_records=1) as writer:
+        writer["example.com"] = _domain("example.com", 1)
+        assert not rawstore.chunk_done(fpath)
+    assert rawstore.chunk_done(fpath)
+    assert list(load_records(fpath).keys()) == ["example.com"]
+
+    # a rerun truncates the file and must not inherit the marker of the earlier run
+    writer = rawstore.StreamingWriter(fpath)
+    assert not rawstore.chunk_done(fpath)
+    writer["example.org"] = _domain("example.org", 2)
+    writer.close(complete=False)
+    assert not rawstore.chunk_done(fpath)
+    assert list(load_records(fpath).keys()) == ["example.org"]
+
+
+def test_streaming_writer_append(tmp_path):
+    fpath = str(tmp_path / "output_000.rec")
+    writer = rawstore.StreamingWriter(fpath)
+    writer["example.com"] = _domain("example.com", 1)
+    writer.close(complete=False)
+    with rawstore.StreamingWriter(fpath, append=True) as writer:
+        writer["example.org"] = _domain("example.org", 2)
+    assert list(load_records(fpath).keys()) == ["example.com", "example.org"]
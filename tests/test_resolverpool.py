@@ -0,0 +1,25 @@
+import asyncio
+import collections
+
+from resolverpool import ResolverPool
+
+
+class _Resolver:
+    async def resolve(self, qname, rdtype="A", rdclass=1, raise_on_no_answer=True):
+        return qname
+
+
+def test_queries_spread_round_robin():
+    async def run():
+        pool = ResolverPool({"192.0.2.1": _Resolver(), "192.0.2.2": _Resolver(), "192.0.2.3": _Resolver()})
+        return collections.Counter([pool.pick(set()).address for _ in range(300)])
+
+    assert set(asyncio.run(run()).values()) == {100}
+
+
+def test_pick_skips_tried_upstreams():
+    async def run():
+        pool = ResolverPool({"192.0.2.4": _Resolver(), "192.0.2.5": _Resolver()})
+        return pool.pick({"192.0.2.4"}).address
+
+    assert asyncio.run(run()) == "192.0.2.5"